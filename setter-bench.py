@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks setter.py against synthetic content files. Generates a
+#setter:Ln= content file of a chosen shape, then times each phase of a
+setter run separately and writes the timings as a JSON report.
+"""
+
+import logging
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import json
+except ImportError:
+    print "setter-bench.py needs python 2.6 or later for the json module"
+    sys.exit(1)
+
+# setter.py lives next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import setter
+
+# same depth limit setter.py's main() applies to the level options
+MAX_DEPTH = 10
+
+# SiLK stand-ins that read their input and write an empty output file, so the
+# SiLK phase measures process start-up and piping rather than SiLK itself
+STUB_RWSETBUILD = """#!/bin/sh
+cat > /dev/null
+: > "$2"
+"""
+STUB_RWPMAPBUILD = """#!/bin/sh
+cat > /dev/null
+: > "$4"
+"""
+STUB_RWSETTOOL = """#!/bin/sh
+out=`echo "$2" | sed 's/^--output-path=//'`
+: > "$out"
+"""
+
+def getAddressLine(blocknum):
+    # cycle through the address syntaxes setter-content.txt uses, each on
+    # its own /24 so nodes don't overlap
+    a = 10 + (blocknum >> 16)
+    b = (blocknum >> 8) & 255
+    c = blocknum & 255
+    style = blocknum % 6
+    if style == 0:
+        return "%d.%d.%d.0/24" % (a, b, c)
+    elif style == 1:
+        return "%d.%d.%d.x" % (a, b, c)
+    elif style == 2:
+        return "%d.%d.%d.1-20" % (a, b, c)
+    elif style == 3:
+        return "%d.%d.%d.5,9,200" % (a, b, c)
+    elif style == 4:
+        return "%d.%d.%d.0/25    # trailing comment" % (a, b, c)
+    else:
+        return "%d.%d.%d.0" % (a, b, c)
+
+def writeContentFile(path, fanout, depth, blocks):
+    # writes a content file with a named L0, fanout children per node down to
+    # depth, and blocks address lines on every node below the root;
+    # returns (node count, address line count)
+    contentFile = open(path, 'w')
+    contentFile.write("# synthetic setter content: fanout %d depth %d blocks %d\n" % (fanout, depth, blocks))
+    contentFile.write("#setter:L0=bench\n")
+    counts = [1, 0]
+    writeContentLevel(contentFile, 1, fanout, depth, blocks, counts)
+    contentFile.close()
+    return (counts[0], counts[1])
+
+def writeContentLevel(contentFile, level, fanout, depth, blocks, counts):
+    if level > depth:
+        return
+    for i in range(fanout):
+        nodenum = counts[0]
+        counts[0] += 1
+        contentFile.write("\n#setter:L%d=n%d|Node %d\n" % (level, nodenum, nodenum))
+        for j in range(blocks):
+            contentFile.write("%s\n" % getAddressLine(counts[1]))
+            counts[1] += 1
+        writeContentLevel(contentFile, level + 1, fanout, depth, blocks, counts)
+
+def makeStubPath(stubdir):
+    os.mkdir(stubdir)
+    for name, text in (("rwsetbuild", STUB_RWSETBUILD), ("rwpmapbuild", STUB_RWPMAPBUILD),
+            ("rwsettool", STUB_RWSETTOOL)):
+        stubpath = os.path.join(stubdir, name)
+        stubFile = open(stubpath, 'w')
+        stubFile.write(text)
+        stubFile.close()
+        os.chmod(stubpath, 0755)
+    os.environ['PATH'] = "%s%s%s" % (stubdir, os.pathsep, os.environ.get('PATH', ''))
+
+def timePhase(report, phase, func, *args):
+    # runs func, records wall and cpu seconds under phase, and returns its result
+    wallstart = time.time()
+    cpustart = time.clock()
+    result = func(*args)
+    report['phases'][phase] = {
+        'wall_seconds': time.time() - wallstart,
+        'cpu_seconds': time.clock() - cpustart,
+    }
+    return result
+
+def queueBuilds(root, outpath, aggregate, unionpath):
+    builds = []
+    setter.createSetFiles(root, outpath, MAX_DEPTH, aggregate, builds, unionpath)
+    setter.createPmapFiles(root, outpath, MAX_DEPTH, aggregate, builds)
+    setter.createPmapFiles(root, outpath, MAX_DEPTH, aggregate, builds, True)
+    return builds
+
+def generateText(builds, spooldir):
+    # generates and hashes every build's tool input the way a setter run does,
+    # keeping the text in spooldir for the SiLK phase to feed to the tools;
+    # returns total bytes of tool input
+    total = 0
+    for build in builds:
+        build.getDigest(spooldir)
+        if build.spoolcounts is not None:
+            total += build.spoolcounts[1]
+    return total
+
+def countNetblocks(aggregate):
+    total = 0
+    for netblock in aggregate.netblocks:
+        total += netblock.getCount()
+    return total
+
+def runBenchmark(options, workdir):
+    report = {
+        'python': sys.version.split()[0],
+        'parameters': {
+            'fanout': options.fanout,
+            'depth': options.depth,
+            'blocks': options.blocks,
+            'jobs': options.jobs,
+            'union_sets': bool(options.unionsets),
+        },
+        'phases': {},
+    }
+
+    contentpath = os.path.join(workdir, 'setter-content.txt')
+    nodes, lines = writeContentFile(contentpath, options.fanout, options.depth, options.blocks)
+    report['content'] = {
+        'nodes': nodes,
+        'address_lines': lines,
+        'bytes': os.path.getsize(contentpath),
+    }
+
+    root = timePhase(report, 'parse', setter.loadTree, contentpath)
+    aggregate = timePhase(report, 'aggregate', setter.Aggregate, root)
+    report['content']['netblocks'] = countNetblocks(aggregate)
+
+    outpath = os.path.join(workdir, 'setter-out')
+    os.mkdir(outpath)
+    unionpath = None
+    if options.unionsets:
+        unionpath = os.path.join(workdir, 'union')
+        os.mkdir(unionpath)
+    builds = queueBuilds(root, outpath, aggregate, unionpath)
+    report['content']['output_files'] = len(builds)
+    # the SiLK phase feeds the tools this text rather than generating it again
+    spooldir = os.path.join(workdir, 'input')
+    os.mkdir(spooldir)
+    report['content']['tool_input_bytes'] = timePhase(report, 'text', generateText, builds, spooldir)
+
+    if not options.nosilk:
+        makeStubPath(os.path.join(workdir, 'stubs'))
+        timePhase(report, 'silk', setter.runBuilds, builds, options.jobs)
+
+    return report
+
+def processOptions():
+    """ process commandline options """
+    usage = """usage: ./%prog [options]
+    use -h for help / option descriptions
+    """
+
+    parser = optparse.OptionParser(usage)
+    parser.add_option("-b", "--blocks", dest="blocks", type="int", default=4, help="""Address lines per node below the root.  Default is 4.""")
+    parser.add_option("-D", "--depth", dest="depth", type="int", default=4, help="""Levels below the root.  Default is 4.""")
+    parser.add_option("-f", "--fanout", dest="fanout", type="int", default=4, help="""Children per node.  Default is 4.""")
+    parser.add_option("--jobs", dest="jobs", type="int", default=1, help="""Passed to setter as --jobs for the SiLK phase.  Default is 1.""")
+    parser.add_option("-k", "--keep", action="store_true", dest="keep", help="""Keep the working folder with the generated content file and outputs.""")
+    parser.add_option("-o", "--out-file", dest="outfile", help="""Where to write the JSON report.  Default is stdout.""")
+    parser.add_option("-S", "--no-silk", action="store_true", dest="nosilk", help="""Skip the SiLK phase.""")
+    parser.add_option("-u", "--union-sets", action="store_true", dest="unionsets", help="""Build parent sets with setter's union mode.""")
+
+    (options, args) = parser.parse_args()
+
+    if not 1 <= options.depth <= MAX_DEPTH:
+        parser.error("depth must be between 1-%d: you provided '%d'" % (MAX_DEPTH, options.depth))
+    if options.fanout < 1 or options.blocks < 0 or options.jobs < 1:
+        parser.error("fanout and jobs must be 1 or more and blocks 0 or more")
+
+    return (options, args)
+
+def main():
+    (options, args) = processOptions()
+
+    # only warnings and errors from setter itself
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(levelname)-8s %(message)s'))
+    setter.logger.addHandler(handler)
+    setter.logger.setLevel(logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix='setter-bench-')
+    try:
+        report = runBenchmark(options, workdir)
+    finally:
+        if options.keep:
+            sys.stderr.write("Kept working folder %s\n" % (workdir))
+        else:
+            shutil.rmtree(workdir, True)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if options.outfile:
+        outFile = open(options.outfile, 'w')
+        outFile.write(text + "\n")
+        outFile.close()
+    else:
+        print text
+
+if __name__ == "__main__":
+    main()
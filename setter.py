@@ -7,37 +7,417 @@ This software reads specially commented set text files and generates
 both set and pmap files.
 """
 
-# Using old style exception declarations because it works with python 2.4.3
+# Needs python 2.6 or later for hashlib, json, multiprocessing, sqlite3 and
+# Popen.terminate; python 2.4 and 2.5 are no longer supported
+# Old style exception declarations are kept to match the rest of the file
 # Instead of "except IOError as e", using "except IOError, e"
 
+import array
+import bisect
+import collections
 import datetime
 import errno
+import filecmp
+import hashlib
+import itertools
+import json
 import logging, logging.handlers
+import marshal
+import mmap
+import multiprocessing
 import sys
 import optparse
 import os
 from os.path import expanduser
+import resource
+import shutil
+import socket
+import SocketServer
+import sqlite3
+import stat
+import struct
 import subprocess
+import tempfile
+import threading
+import time
+try:
+    import numpy
+except ImportError:
+    # optional; the classify command uses the bisect module without it
+    numpy = None
+
+# default logger so the classes and functions below can be imported and used
+# without main(); main() replaces it with one writing to setter.log
+logger = logging.getLogger('setter')
+
+# bump whenever Node/Netblock/NetblockRange change shape so old tree caches are ignored
+CACHE_FORMAT = 3
+
+# range index file layout, all little-endian uint32s after the magic:
+#   header: magic, version, range count, label count, label table offset, label table size, 0
+#   range count starts, then range count ends, then range count label ids, all
+#   sorted by start with no overlaps
+#   label table: label count + 1 offsets into the text that follows, relative to
+#   the end of the offsets; label i is long name NUL short name NUL node path
+RANGE_INDEX_MAGIC = "SETTERIX"
+RANGE_INDEX_VERSION = 1
+RANGE_INDEX_HEADER = struct.Struct("<8s6I")
 
 class Netblock(object):
-    """Holds network address block, cidr mask, and pmap name/description info"""
-    def __init__(self, startAddress, cidr, pmapName=None, pmapShortName=None):
-        self.startAddress = startAddress
+    """Holds network address block as a 32-bit start integer and cidr mask, plus its owning node for pmap names"""
+    # no per-instance dict; content files can hold millions of these
+    __slots__ = ('start', 'cidr', 'node', 'line', 'source')
+
+    def __init__(self, start, cidr, node=None, line=None, source=None):
+        self.start = start
         self.cidr = cidr
-        self.pmapName = pmapName
-        self.pmapShortName = pmapShortName
+        self.node = node
+        # content file and line number, for error reporting
+        self.line = line
+        self.source = source
         
     def getStartAddress(self):
-        return self.startAddress
+        return intToIp(self.start)
+
+    def getCidr(self):
+        return self.cidr
+
+    def getPmapName(self):
+        # labels live once on the node, not on every block
+        return self.node.getPmapName()
+
+    def getPmapShortName(self):
+        return self.node.getFileName()
+
+    def getCount(self):
+        return 1
+
+    def getNetblocks(self):
+        return [self]
+
+    def getCoverNetblocks(self):
+        return [self]
+
+class NetblockRange(object):
+    """Holds the comma/range/x variants of one address line as per-quad ranges sharing a cidr mask"""
+    __slots__ = ('quads', 'cidr', 'node', 'line', 'source', 'cover')
+
+    def __init__(self, quads, cidr, node=None, line=None, source=None):
+        # four lists of (low, high) ranges, sorted and non-overlapping
+        self.quads = quads
+        self.cidr = cidr
+        self.node = node
+        self.line = line
+        self.source = source
+        self.cover = None
 
     def getCidr(self):
         return self.cidr
 
     def getPmapName(self):
-        return self.pmapName
+        return self.node.getPmapName()
 
     def getPmapShortName(self):
-        return self.pmapShortName
+        return self.node.getFileName()
+
+    def getCount(self):
+        # number of netblocks this expands to
+        return getNumRangesCount(self.quads)
+
+    def getStarts(self):
+        # start address integers in ascending order
+        for alow, ahigh in self.quads[0]:
+            for a in xrange(alow, ahigh + 1):
+                for blow, bhigh in self.quads[1]:
+                    for b in xrange(blow, bhigh + 1):
+                        for clow, chigh in self.quads[2]:
+                            for c in xrange(clow, chigh + 1):
+                                base = (a << 24) | (b << 16) | (c << 8)
+                                for dlow, dhigh in self.quads[3]:
+                                    for d in xrange(dlow, dhigh + 1):
+                                        yield base | d
+
+    def getNetblocks(self):
+        # one netblock per address variant, each with this line's cidr;
+        # this is what the pmaps get so cidr precedence is unchanged
+        for start in self.getStarts():
+            yield Netblock(start, self.cidr, self.node, self.line, self.source)
+
+    def getCoverNetblocks(self):
+        # the fewest cidr blocks covering the same addresses, which is all a set needs
+        if self.cover is None:
+            mask = getCidrMask(self.cidr)
+            size = 1L << (32 - self.cidr)
+            cover = []
+            first = last = None
+            for start in self.getStarts():
+                start = start & mask
+                if first is not None and start <= last + 1:
+                    last = max(last, start + size - 1)
+                    continue
+                if first is not None:
+                    cover.extend(rangeToCidrs(first, last))
+                first = start
+                last = start + size - 1
+            if first is not None:
+                cover.extend(rangeToCidrs(first, last))
+            self.cover = cover
+        netblocklist = []
+        for start, cidr in self.cover:
+            netblocklist.append(Netblock(start, cidr, self.node, self.line, self.source))
+        return netblocklist
+
+class Build(object):
+    """Holds one SiLK tool run: command line, output file, failure message, and how to produce its stdin text"""
+    def __init__(self, args, filename, failmsg, inputfunc, *inputargs):
+        self.args = args
+        self.filename = filename
+        self.failmsg = failmsg
+        self.inputfunc = inputfunc
+        self.inputargs = inputargs
+        # builds whose output files this one reads
+        self.depends = []
+        # scratch outputs only exist to feed other builds and aren't kept
+        self.scratch = False
+        # the node whose own blocks only this build reads, for release()
+        self.owner = None
+        # an output file with the same input to link to instead of running the
+        # tool, and where to keep a copy of the output for later runs
+        self.reuse = None
+        self.cachepath = None
+        # the input text saved while it was hashed, fed to the tool rather than
+        # generating it again, and its [items, bytes] counts
+        self.spool = None
+        self.spoolcounts = None
+        self.digest = None
+        self.proc = None
+        self.returncode = None
+        # filled in by runBuild for the metrics report
+        self.records = 0
+        self.bytes = 0
+        self.seconds = None
+
+    def getInput(self):
+        # lines are generated as they are consumed so neither queued nor
+        # running builds hold their whole input in memory
+        return self.inputfunc(*self.inputargs)
+
+    def getDigest(self, spooldir=None):
+        # content hash of what goes into the output file: the stdin text, or for
+        # builds that only read other outputs, the hashes of those outputs
+        # spooldir, if given, keeps the text in a file there for runBuild
+        if self.digest is None:
+            digest = hashlib.sha1(self.args[0])
+            if self.inputfunc is None:
+                for dependency in self.depends:
+                    digest.update(dependency.getDigest(spooldir))
+            elif spooldir is not None:
+                fd, self.spool = tempfile.mkstemp(dir=spooldir)
+                spoolFile = os.fdopen(fd, 'wb')
+                try:
+                    self.spoolcounts = writeLines(spoolFile, hashLines(self.getInput(), digest))
+                finally:
+                    spoolFile.close()
+                # the spool is the input now
+                self.inputargs = ()
+            else:
+                for line in self.getInput():
+                    digest.update(line)
+            self.digest = digest.hexdigest()
+        return self.digest
+
+    def dropSpool(self):
+        if self.spool is not None:
+            try:
+                os.remove(self.spool)
+            except OSError:
+                pass
+            self.spool = None
+
+    def release(self, dropblocks=False):
+        # keep just the digest once the build is done with, so finished builds
+        # don't hold on to what their input came from; dropblocks also empties
+        # the owner's own blocks, for when no other build reads them
+        self.getDigest()
+        self.dropSpool()
+        self.inputfunc = None
+        self.inputargs = ()
+        if dropblocks and self.owner is not None:
+            self.owner.netblocks = []
+
+class BuildPipeline(object):
+    """Runs builds jobs at a time as they are submitted, each once the builds it depends on have finished"""
+    def __init__(self, jobs=1, dropblocks=False, backlog=None):
+        self.cond = threading.Condition()
+        self.ready = collections.deque()
+        # count of unfinished dependencies per build still waiting, and who is
+        # waiting on whom
+        self.waiting = {}
+        self.dependents = {}
+        # submitted builds that haven't finished
+        self.unfinished = set()
+        self.running = []
+        self.failed = []
+        self.closed = False
+        # passed to release() on each build once it has run
+        self.dropblocks = dropblocks
+        # if given, submit waits while this many builds are ready but not
+        # started, so spooled input doesn't pile up ahead of the tools
+        self.backlog = backlog
+        self.threads = []
+        for i in range(jobs):
+            thread = threading.Thread(target=self.work)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, build):
+        # dependencies must be submitted first; any never submitted (already up
+        # to date) count as done; raises RuntimeError once a build has failed
+        self.cond.acquire()
+        try:
+            while self.backlog and len(self.ready) >= self.backlog and not self.failed:
+                # with a timeout so ctrl-c still gets through
+                self.cond.wait(1)
+            if self.failed:
+                raise RuntimeError(self.failed[0].failmsg)
+            self.unfinished.add(build)
+            waiting = 0
+            for dependency in build.depends:
+                if dependency in self.unfinished:
+                    waiting += 1
+                    self.dependents.setdefault(dependency, []).append(build)
+            if waiting:
+                self.waiting[build] = waiting
+            else:
+                self.ready.append(build)
+                self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def work(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.failed and not self.ready and not (self.closed and not self.unfinished):
+                    self.cond.wait()
+                if self.failed or not self.ready:
+                    return
+                build = self.ready.popleft()
+                self.running.append(build)
+                if self.backlog:
+                    self.cond.notifyAll()
+            finally:
+                self.cond.release()
+            try:
+                returncode = runBuild(build)
+            except Exception, e:
+                # the tool or its input generator failed in some other way; stop
+                # the tool and take the usual failure path so nothing is left
+                # waiting on this build
+                logger.error("Exception running %s for %s: %s" % (build.args[0], build.filename, str(e)))
+                if build.proc is not None and build.proc.poll() is None:
+                    build.proc.terminate()
+                    build.proc.wait()
+                build.returncode = 1
+                returncode = 1
+            if not returncode:
+                build.release(self.dropblocks)
+            self.cond.acquire()
+            try:
+                self.running.remove(build)
+                self.unfinished.discard(build)
+                if returncode:
+                    if not self.failed:
+                        self.failed.append(build)
+                        # cancel everything else still in flight
+                        for other in self.running:
+                            if other.proc is not None and other.proc.poll() is None:
+                                logger.debug("Stopping %s after failure of %s" % (other.filename, build.filename))
+                                other.proc.terminate()
+                else:
+                    for dependent in self.dependents.pop(build, []):
+                        self.waiting[dependent] -= 1
+                        if not self.waiting[dependent]:
+                            del self.waiting[dependent]
+                            self.ready.append(dependent)
+                self.cond.notifyAll()
+            finally:
+                self.cond.release()
+
+    def finish(self):
+        # wait for everything submitted to run; the first failure stops any
+        # further dispatch, stops builds still running, and is raised as a
+        # RuntimeError
+        self.cond.acquire()
+        try:
+            self.closed = True
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+        for thread in self.threads:
+            # join with a timeout so ctrl-c still reaches the main thread
+            while thread.isAlive():
+                thread.join(1)
+        if self.failed:
+            raise RuntimeError(self.failed[0].failmsg)
+
+class Metrics(object):
+    """Collects per-phase wall/cpu timings and per-file build results, written as JSON by -m/--metrics"""
+    def __init__(self):
+        self.phases = []
+        self.phase = None
+
+    def startPhase(self, name):
+        self.phase = (name, time.time(), os.times())
+
+    def endPhase(self):
+        name, wallstart, cpustart = self.phase
+        cpuend = os.times()
+        self.phases.append({
+            'phase': name,
+            'wall_seconds': time.time() - wallstart,
+            # this process, and the SiLK tools it waited on
+            'cpu_seconds': (cpuend[0] + cpuend[1]) - (cpustart[0] + cpustart[1]),
+            'child_cpu_seconds': (cpuend[2] + cpuend[3]) - (cpustart[2] + cpustart[3]),
+        })
+        self.phase = None
+
+    def write(self, path, root, aggregate, builds, totals=None):
+        # totals, if given, is (net blocks, addresses) counted while parsing,
+        # for runs that don't keep every block until the end
+        files = []
+        for build in builds:
+            files.append({
+                'file': build.filename,
+                'tool': build.args[0],
+                'scratch': build.scratch,
+                # None for builds skipped as unchanged or never started
+                'exit_status': build.returncode,
+                'netblocks': build.records,
+                'bytes': build.bytes,
+                'seconds': build.seconds,
+                # the identical output linked to rather than running the tool
+                'reused': build.reuse,
+            })
+        if totals is None:
+            totals = getNetblockTotals(aggregate.netblocks)
+        netblocks, addresses = totals
+        report = {
+            'version': version,
+            'nodes': countNodes(root),
+            'netblocks': netblocks,
+            'addresses': addresses,
+            # kilobytes on linux
+            'peak_rss_self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_rss_children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            'phases': self.phases,
+            'files': files,
+        }
+        metricsFile = tryOpen(path, 'w')
+        json.dump(report, metricsFile, indent=2, sort_keys=True)
+        metricsFile.write("\n")
+        tryClose(metricsFile)
 
 class Node(object):
     """Tree node that holds level info, name, long name, local netblocks, and parent/children refs"""
@@ -62,8 +442,7 @@ class Node(object):
         child.level = self.level + 1
 
     def addNetblock(self, netblock):
-        netblock.pmapName = self.getPmapName() 
-        netblock.pmapShortName = self.getFileName() 
+        netblock.node = self
         self.netblocks.append(netblock)
 
     def getName(self):
@@ -84,6 +463,13 @@ class Node(object):
             self.filename = joinstr.join(filenamelist)
         return self.filename 
 
+    def getPath(self, joinstr='/'):
+        # same names as the file name but not cached, so any joiner can be used
+        pathlist = []
+        self.fillFileNameList(pathlist)
+        pathlist.reverse()
+        return joinstr.join(pathlist)
+
     def fillFileNameList(self, filenamelist):
         # file name will consist of a concatenation of short names
         # between this node and all parent nodes with short names
@@ -94,7 +480,7 @@ class Node(object):
             if self.name != "":
                 filenamelist.append(self.name)
             # walk toward root
-            if self.level:
+            if self.parent is not None:
                 self.parent.fillFileNameList(filenamelist)
 
     def getPmapName(self, joinstr=' - '):
@@ -116,7 +502,7 @@ class Node(object):
             if self.longName != "":
                 pmapnamelist.append(self.longName)
             # walk toward root
-            if self.level:
+            if self.parent is not None:
                 self.parent.fillPmapNameList(pmapnamelist)
 
     def getNetblocks(self, netblocklist, localOnly=False):
@@ -129,6 +515,535 @@ class Node(object):
                 child.getNetblocks(netblocklist, localOnly)
         #logger.debug("At end of getnetblocks call for node %s, netblocklist has %d length" % (self.getName(),len(netblocklist)))
 
+class Aggregate(object):
+    """Collects every tree netblock once, in pre-order, and serves each node's descendant blocks from that shared list"""
+    def __init__(self, root):
+        # all netblocks in the same order the old recursive getNetblocks produced,
+        # so a node's descendant blocks are always one contiguous slice
+        self.netblocks = []
+        # node -> (start, end) slice into self.netblocks
+        self.spans = {}
+        self.fillSpans(root)
+        # cidr -> ascending list of positions in self.netblocks; walking the cidrs in
+        # order gives the same result as a stable sort by cidr, done once for the tree
+        self.buckets = {}
+        for position, block in enumerate(self.netblocks):
+            self.buckets.setdefault(block.cidr, []).append(position)
+        self.cidrs = sorted(self.buckets.keys())
+
+    def fillSpans(self, node):
+        # post-order walk; each node's span closes once its children have been added
+        start = len(self.netblocks)
+        self.netblocks.extend(node.netblocks)
+        for child in node.children:
+            self.fillSpans(child)
+        self.spans[node] = (start, len(self.netblocks))
+
+    def getNetblocks(self, node):
+        start, end = self.spans[node]
+        return self.netblocks[start:end]
+
+    def getSortedNetblocks(self, node):
+        # node's descendant blocks sorted by cidr with most granular on bottom
+        start, end = self.spans[node]
+        netblocklist = []
+        for cidr in self.cidrs:
+            positions = self.buckets[cidr]
+            lo = bisect.bisect_left(positions, start)
+            hi = bisect.bisect_left(positions, end, lo)
+            for position in positions[lo:hi]:
+                netblocklist.append(self.netblocks[position])
+        return netblocklist
+
+class LookupIndex(object):
+    """Longest-prefix-match index over a tree's netblocks, keyed by network address per cidr"""
+    def __init__(self, root):
+        # cidr -> {network address int: owning node}
+        self.tables = {}
+        self.fillTables(root)
+        # most specific first, which is the order pmap precedence resolves in
+        self.cidrs = sorted(self.tables.keys())
+        self.cidrs.reverse()
+        self.masks = {}
+        for cidr in self.cidrs:
+            self.masks[cidr] = getCidrMask(cidr)
+
+    def fillTables(self, node):
+        # pre-order, so for duplicate blocks the later entry wins like it does in the pmap
+        for netblock in node.netblocks:
+            for block in netblock.getNetblocks():
+                table = self.tables.setdefault(block.cidr, {})
+                table[block.start & getCidrMask(block.cidr)] = node
+        for child in node.children:
+            self.fillTables(child)
+
+    def lookup(self, address):
+        # address may be dotted-quad text or an integer; returns the owning node or None
+        if not isinstance(address, (int, long)):
+            address = ipToInt(address)
+        for cidr in self.cidrs:
+            node = self.tables[cidr].get(address & self.masks[cidr])
+            if node is not None:
+                return node
+        return None
+
+class RangeClassifier(object):
+    """Labels addresses in bulk by binary search over the tree's flattened, non-overlapping ranges"""
+    def __init__(self, root):
+        aggregate = Aggregate(root)
+        self.starts = []
+        self.ends = []
+        # ",long name,short name" output per range, plus a last one for
+        # addresses outside every range
+        self.labels = []
+        for first, last, node in flattenNetblocks(aggregate.getSortedNetblocks(root), getNodeLabel):
+            self.starts.append(first)
+            self.ends.append(last)
+            self.labels.append(",%s,%s\n" % (node.getPmapName(), node.getFileName()))
+        self.labels.append(",,\n")
+        if numpy is not None:
+            self.startarray = numpy.array(self.starts, dtype=numpy.uint32)
+            self.endarray = numpy.array(self.ends, dtype=numpy.uint32)
+            self.labelarray = numpy.array(self.labels, dtype=object)
+
+    def classify(self, numbers):
+        # returns the output label for each address number, in order
+        if numpy is not None and self.starts:
+            numbers = numpy.array(numbers, dtype=numpy.uint32)
+            positions = numpy.searchsorted(self.startarray, numbers, side='right') - 1
+            inside = (positions >= 0) & (numbers <= self.endarray[positions])
+            positions[~inside] = len(self.starts)
+            return self.labelarray[positions]
+        labels = []
+        for number in numbers:
+            position = bisect.bisect_right(self.starts, number) - 1
+            if position >= 0 and number <= self.ends[position]:
+                labels.append(self.labels[position])
+            else:
+                labels.append(self.labels[-1])
+        return labels
+
+class RangeIndex(object):
+    """Reads a range index file through mmap, binary searching it in place so processes share the page cache"""
+    def __init__(self, path):
+        indexFile = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            indexFile.close()
+        if len(self.map) < RANGE_INDEX_HEADER.size:
+            raise ValueError("not a setter range index: %s" % path)
+        (magic, version, self.count, self.labelcount, labeloffset, labelsize,
+            reserved) = RANGE_INDEX_HEADER.unpack_from(self.map, 0)
+        if magic != RANGE_INDEX_MAGIC or version != RANGE_INDEX_VERSION:
+            raise ValueError("not a version %d setter range index: %s" % (RANGE_INDEX_VERSION, path))
+        if labeloffset + labelsize > len(self.map):
+            raise ValueError("truncated setter range index: %s" % path)
+        self.startsoffset = RANGE_INDEX_HEADER.size
+        self.endsoffset = self.startsoffset + 4 * self.count
+        self.labelidsoffset = self.endsoffset + 4 * self.count
+        self.labeloffset = labeloffset
+        self.textoffset = labeloffset + 4 * (self.labelcount + 1)
+
+    def getStart(self, position):
+        return struct.unpack_from("<I", self.map, self.startsoffset + 4 * position)[0]
+
+    def getEnd(self, position):
+        return struct.unpack_from("<I", self.map, self.endsoffset + 4 * position)[0]
+
+    def getLabel(self, labelid):
+        # (long name, short name, node path)
+        first, last = struct.unpack_from("<2I", self.map, self.labeloffset + 4 * labelid)
+        return tuple(self.map[self.textoffset + first:self.textoffset + last].split("\0"))
+
+    def lookup(self, address):
+        # address may be dotted-quad text or an integer; returns (long name,
+        # short name, node path) or None when no range holds it
+        if not isinstance(address, (int, long)):
+            address = ipToInt(address)
+        # last range starting at or before address
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.getStart(middle) <= address:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0 or self.getEnd(low - 1) < address:
+            return None
+        labelid = struct.unpack_from("<I", self.map, self.labelidsoffset + 4 * (low - 1))[0]
+        return self.getLabel(labelid)
+
+    def close(self):
+        self.map.close()
+
+class LookupHandler(SocketServer.BaseRequestHandler):
+    """Answers one serve connection: addresses in, one lookup line out per address"""
+    def handle(self):
+        # reads whatever has arrived and answers every complete line in it with
+        # one send, which keeps both batch and one-at-a-time clients fast
+        pending = ""
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            lines = (pending + data).split('\n')
+            pending = lines.pop()
+            self.answer(lines)
+        # a last line without a newline
+        self.answer([pending])
+
+    def answer(self, lines):
+        # the index in use when the lines arrived answers all of them, even if
+        # a reload swaps in a new one partway through
+        index = self.server.index
+        replies = []
+        # same input as lookup: comma-separated addresses, one or more per line
+        for line in lines:
+            if '#' in line:
+                line = line.split('#')[0]
+            for address in line.split(','):
+                address = address.strip()
+                if address:
+                    # one reply per address, so clients can match them up
+                    replies.append(formatLookup(index, address, True))
+        if replies:
+            self.request.sendall("".join(replies))
+
+class LookupServer(SocketServer.ThreadingUnixStreamServer):
+    """Unix socket server answering lookups from an index that reloads replace whole"""
+    daemon_threads = True
+
+    def __init__(self, socketpath, index):
+        SocketServer.ThreadingUnixStreamServer.__init__(self, socketpath, LookupHandler)
+        self.index = index
+
+class Include(object):
+    """Holds one include directive: the placeholder node its subtree replaces, the file, and the files including it"""
+    def __init__(self, slot, path, chain, location):
+        self.slot = slot
+        self.path = path
+        # real paths of the files that led to this one, to catch include loops
+        self.chain = chain
+        self.location = location
+
+class Parser(object):
+    """Reads one setter text file into the tree under a given node, keeping all parse state to itself"""
+    def __init__(self, path, root, pmapconcat=' - ', main=True, chain=(), onclose=None):
+        self.path = path
+        # the tree's root for the main file; for an included file, a stand-in
+        # at the level of the node it was included under
+        self.root = root
+        self.pmapconcat = pmapconcat
+        # only the main file may have a level 0 entry
+        self.main = main
+        self.chain = chain + (os.path.realpath(path),)
+
+        # where are we in the tree
+        self.currentnode = root
+
+        # make sure there's only one level 0 in configs if provided and it comes first
+        self.levelzeroingested = False
+        self.levelentryingested = False
+
+        # track lines in set.txt file for error reporting
+        self.linecounter = 0
+
+        # include directives found, in file order
+        self.includes = []
+
+        # called with each node once no more lines can add to it or its
+        # descendants, children before parents
+        self.onclose = onclose
+
+    def getLocation(self):
+        if self.main:
+            return "Line %d" % (self.linecounter)
+        return "Line %d of %s" % (self.linecounter, self.path)
+
+    def parse(self):
+        setFile  = tryOpen(self.path, 'r')
+        for line in setFile:
+            self.linecounter += 1
+            self.parseLine(line)
+        tryClose(setFile)
+        if self.onclose is not None:
+            self.closeNodes(self.root.level)
+
+    def closeNodes(self, level):
+        # a new entry at level closes the current node and its ancestors down to
+        # that level, since later lines can only add to nodes above it
+        node = self.currentnode
+        while node is not None and node.level >= level:
+            self.onclose(node)
+            node = node.parent
+
+    def parseLine(self, line):
+        location = self.getLocation()
+
+        # ignore blank lines
+        if len(line.strip()) == 0:
+            return
+
+        # chop off any newlines and beginning/ending white space
+        line = line.strip()
+
+        if line.startswith('#setter-include:'):
+            self.parseInclude(line, location)
+            return
+
+        if line.startswith('#') and not line.startswith('#setter:'):
+            logger.debug("%s: Skipping comment: %s" % (location,line))
+            return
+
+        if line.startswith('#setter:'):
+            # load the config info
+
+            logger.debug("%s: Found setter config line: %s" % (location,line))
+
+            level,name,longname = getConfigLineTokens(line, location)
+
+            # change the info on the root node
+            # make sure we only have one level zero entry and it is the first entry
+            # so we can rename root before populating other nodes
+            if level == 0:
+                if not self.main:
+                    logger.error("%s: Level 0 entries are only allowed in the main setter text file: %s" % (location,line))
+                    sys.exit(1)
+
+                if self.levelzeroingested:
+                    logger.error("%s: You may only include one level 0 entry and it must be the first setter config entry: %s" % (location,line))
+                    sys.exit(1)
+                else:
+                    self.levelzeroingested = True
+
+                if self.levelentryingested:
+                    logger.error("%s: If you include a level 0 entry it must be the first setter config entry: %s" % (location,line))
+                    sys.exit(1)
+                else:
+                    self.levelentryingested = True
+
+                self.root.setName(name)
+                self.root.setLongName(longname)
+                return
+
+            # cover non-zero ingests and the case where no level zero included in configs
+            if self.levelentryingested == False:
+                self.levelentryingested = True
+
+            # an included file can only add nodes below the node it was included under
+            if level <= self.root.level:
+                logger.error("%s: Included file entries must be deeper than L%d, the level they were included at: %s" % (location,self.root.level,line))
+                sys.exit(1)
+
+            currentnode = self.currentnode
+
+            # asking to go down more than one node
+            if (level - currentnode.level) > 1:
+                logger.error("%s: Inconsistent level assignment; e.g., L3 being assigned before L2: %s" % (location,line))
+                sys.exit(1)
+
+            if self.onclose is not None:
+                self.closeNodes(level)
+
+            # asking to add child
+            if level == currentnode.level + 1:
+                # create a node and add it as child
+                child = Node(name,longname,currentnode)
+                currentnode = child
+
+            # asking to add sibling
+            elif level == currentnode.level:
+                currentnode = currentnode.parent
+                # create a node and add it as child
+                child = Node(name,longname,currentnode)
+                currentnode = child
+
+            # asking to add node higher in the tree
+            elif level < currentnode.level:
+                while (level - 1) < currentnode.level:
+                    currentnode = currentnode.parent
+                # create a node and add it as child
+                child = Node(name,longname,currentnode)
+                currentnode = child
+
+            self.currentnode = currentnode
+
+        else:
+            # build netblock instance from address info
+            # some lines will need to be converted into multiple netblocks
+            # e.g., 2.3-4.2.2 would produce 2 netblocks
+
+            logger.debug("%s: Found address line of %s" % (location, line))
+
+            blocks = getConfigLineNetblocks(line, location)
+            for block in blocks:
+                if block.getCount() == 1:
+                    logger.debug("%s: Adding netblock %s/%d to node %s" % (location,
+                        block.getStartAddress(), block.getCidr(), self.currentnode.getPath()))
+                else:
+                    logger.debug("%s: Adding %d /%d netblocks from %s to node %s" % (location,
+                        block.getCount(), block.getCidr(), line, self.currentnode.getPath()))
+                block.line = self.linecounter
+                block.source = self.path
+                self.currentnode.addNetblock(block)
+
+    def parseInclude(self, line, location):
+        #setter-include:path/to/fragment.txt
+        # the included file's nodes go under the current node, at this spot among
+        # its children; relative paths are relative to this file's folder
+        path = line[len('#setter-include:'):].strip()
+        if self.onclose is not None:
+            # the included nodes would go in among nodes already built
+            logger.error("%s: Include lines can't be used with --stream: %s" % (location,line))
+            sys.exit(1)
+        if not path:
+            logger.error("%s: Include directive needs a file path: %s" % (location,line))
+            sys.exit(1)
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(self.path), path)
+        if not os.path.isfile(path):
+            logger.error("%s: Included file does not exist or is not a file: %s" % (location,path))
+            sys.exit(1)
+        if os.path.realpath(path) in self.chain:
+            logger.error("%s: File includes itself, directly or through other includes: %s" % (location,path))
+            sys.exit(1)
+        logger.debug("%s: Found include of %s" % (location,path))
+
+        # an include counts as an entry as far as the level 0 rules go
+        self.levelentryingested = True
+        slot = Node("", "", self.currentnode)
+        self.includes.append(Include(slot, path, self.chain, location))
+
+class BuildQueue(object):
+    """Skips, links, or submits each build to a BuildPipeline as soon as it is queued, so input is hashed while earlier tools run"""
+    def __init__(self, options, manifest, spooldir=None, dropblocks=False, replace=False):
+        self.options = options
+        self.manifest = manifest
+        # where input text hashed at queue time waits for its build
+        self.spooldir = spooldir
+        # passed to release() on builds once they are done with
+        self.dropblocks = dropblocks
+        # remove an old output file before it is rebuilt (see buildOutputs)
+        self.replace = replace
+        # submitting waits while jobs builds are ready to start, so only about
+        # twice jobs spool files exist at once
+        self.pipeline = BuildPipeline(options.jobs, dropblocks, options.jobs)
+        # every build, in the order queued, for the manifest and metrics
+        self.builds = []
+        # builds submitted to run or link, not counting scratch builds
+        self.queued = []
+        self.skipped = 0
+        # input hash -> output with that input, for setReuse
+        self.outputs = {}
+
+    def queue(self, build, scratch=None):
+        # scratch, if given, is a scratch build that only build reads
+        if scratch is not None:
+            self.builds.append(scratch)
+        self.builds.append(build)
+        if self.options.force:
+            # nothing is skipped or linked; inputs are hashed as they are fed
+            if scratch is not None:
+                self.pipeline.submit(scratch)
+            self.submit(build)
+            return
+        if isBuildCurrent(build, self.manifest, self.spooldir):
+            logger.debug("Unchanged since last build: %s" % (build.filename))
+            self.skipped += 1
+            if scratch is not None:
+                self.skipped += 1
+            self.outputs.setdefault(build.getDigest(), build.filename)
+            if scratch is not None:
+                scratch.release(self.dropblocks)
+            build.release(self.dropblocks)
+            return
+        # a build linking to an identical output doesn't need its scratch input
+        setReuse(build, self.outputs, self.options.reusecache)
+        if build.reuse is not None:
+            build.dropSpool()
+        if scratch is not None:
+            if build.reuse is None:
+                setReuse(scratch, self.outputs, self.options.reusecache)
+                self.pipeline.submit(scratch)
+            else:
+                scratch.release(self.dropblocks)
+        self.submit(build)
+
+    def submit(self, build):
+        if self.replace and os.path.exists(build.filename):
+            os.remove(build.filename)
+        self.queued.append(build)
+        self.pipeline.submit(build)
+
+    def finish(self):
+        self.pipeline.finish()
+
+    def logResults(self, manifestpath):
+        if self.skipped:
+            logger.info("Skipped %d of %d files whose input is unchanged per %s" % (self.skipped, len(self.builds), manifestpath))
+        reused = 0
+        for build in self.builds:
+            if build.reuse is not None:
+                reused += 1
+        if reused:
+            logger.info("Linked %d files to identical outputs rather than rebuilding them" % (reused))
+
+class StreamBuilder(BuildQueue):
+    """Queues a node's files to be built as soon as the parser closes the node, for --stream"""
+    def __init__(self, outpath, options, manifest, unionpath=None, spooldir=None):
+        # a node's blocks can only be dropped once built when no other file reads
+        # them: every parent set is a union of its children's files and there
+        # are no pmaps, which read every descendant block
+        dropblocks = (unionpath is not None and options.nolongpmap and options.noshortpmap
+            and options.setlevel == MAX_DEPTH)
+        BuildQueue.__init__(self, options, manifest, spooldir, dropblocks)
+        self.outpath = outpath
+        self.unionpath = unionpath
+        # node -> build of its set file, until its parent's union takes it
+        self.setbuilds = {}
+        # net blocks and addresses counted as nodes close
+        self.netblocks = 0
+        self.addresses = 0
+
+    def closeNode(self, node):
+        options = self.options
+        # names are cached now, while the node's ancestors are all still known
+        node.getPmapName(options.pmapconcat)
+        node.getFileName()
+        netblocks, addresses = getNetblockTotals(node.netblocks)
+        self.netblocks += netblocks
+        self.addresses += addresses
+
+        makeset = not options.noset and node.level <= options.setlevel
+        union = self.unionpath is not None and len(node.children) and node.level < options.setlevel
+        makelong = not options.nolongpmap and node.level <= options.pmaplonglevel
+        makeshort = not options.noshortpmap and node.level <= options.pmapshortlevel
+        aggregate = None
+        if (makeset and not union) or makelong or makeshort:
+            aggregate = Aggregate(node)
+
+        if makeset:
+            if union:
+                depends = []
+                for child in node.children:
+                    depends.append(self.setbuilds.pop(child))
+                local, build = makeUnionBuilds(node, self.outpath, aggregate, self.unionpath, depends)
+                if local is not None:
+                    local.owner = node
+            else:
+                local = None
+                build = makeSetBuild(node, self.outpath, aggregate)
+                if not node.children:
+                    build.owner = node
+            self.queue(build, local)
+            self.setbuilds[node] = build
+
+        if makelong:
+            self.queue(makePmapBuild(node, self.outpath, aggregate, False, options.flattenpmaps))
+        if makeshort:
+            self.queue(makePmapBuild(node, self.outpath, aggregate, True, options.flattenpmaps))
 
 def main():
 
@@ -146,6 +1061,10 @@ def main():
     global MAX_DEPTH
     MAX_DEPTH = 10
 
+    # per-output-file input hashes, kept in the output folder
+    global MANIFEST_FILENAME
+    MANIFEST_FILENAME = 'setter-manifest.txt'
+
     global options, args
     (options, args) = processOptions()
 
@@ -157,32 +1076,21 @@ def main():
         mypath = expanduser("~")
     LOG_FILENAME = "%s/%s" % (mypath, 'setter.log') 
 
-    # we'll be reading in one set.txt file
-    global SET_TXT_FILE
+    # we'll be reading in one main set.txt file, plus any others given
+    global SET_TXT_FILES
     if options.settxtfile:
-        # expecting full path including file name
-        SET_TXT_FILE = options.settxtfile
+        # expecting full paths including file name
+        SET_TXT_FILES = options.settxtfile
     else:
         # home folder
         mypath = expanduser("~")
-        SET_TXT_FILE = "%s/%s" % (mypath, 'setter-content.txt') 
-    checkFile(SET_TXT_FILE)
+        SET_TXT_FILES = ["%s/%s" % (mypath, 'setter-content.txt')]
+    # diff given both its files doesn't read these
+    if not (len(args) == 3 and args[0] == 'diff'):
+        for path in SET_TXT_FILES:
+            checkFile(path)
 
-    # where are we in the tree
-    global currentnode
     global root
-    root = Node("root","")
-    currentnode = root
-
-    # make sure there's only one level 0 in configs if provided and it comes first
-    global levelzeroingested
-    levelzeroingested = False
-    global levelentryingested
-    levelentryingested = False
-    
-    # track lines in set.txt file for error reporting
-    global linecounter
-    linecounter = 0
 
     ########### 
     ##  Logger set up
@@ -219,7 +1127,54 @@ def main():
 
     logger.info("Check the log file at %s for debug-level logging info" % LOG_FILENAME)
 
-    readSetTextFile()
+    if len(args) and args[0] == 'diff':
+        # compares its own files, so this comes before the usual parse; exits
+        # 1 when there are differences, like diff(1)
+        if doDiff(args[1:], SET_TXT_FILES, options):
+            sys.exit(1)
+        sys.exit(0)
+
+    if options.reusecache:
+        mkdir_p(options.reusecache)
+
+    # phase timings and per-file results for -m/--metrics
+    metrics = Metrics()
+
+    if options.stream:
+        checkStreamOptions(options, args)
+        outpath = getOutPath(options)
+        mkdir_p(outpath)
+        streamOutputs(SET_TXT_FILES[0], outpath, options, metrics)
+        sys.exit(0)
+
+    metrics.startPhase('parse')
+    # every file read, including any pulled in by include lines
+    sources = []
+    root = loadContent(SET_TXT_FILES, options, sources)
+    metrics.endPhase()
+
+    if options.checkoverlaps:
+        # like -t and -f, this is a content check so don't go any further
+        if printOverlaps(findOverlaps(root)):
+            sys.exit(1)
+        sys.exit(0)
+
+    if len(args):
+        command = args[0]
+        if command == 'lookup':
+            doLookup(root, args[1:])
+            sys.exit(0)
+        if command == 'export-sqlite':
+            doExportSqlite(root, sources, args[1:])
+            sys.exit(0)
+        if command == 'classify':
+            doClassify(root, args[1:])
+            sys.exit(0)
+        if command == 'serve':
+            doServe(root, sources, args[1:], SET_TXT_FILES, options)
+            sys.exit(0)
+        logger.error("Unknown command '%s'; the commands are lookup, classify, diff, export-sqlite, and serve" % (command))
+        sys.exit(1)
 
     # prints out the tree that gets loaded as a quick check
     if options.printtree:
@@ -233,73 +1188,1353 @@ def main():
         # these are for testing the context file so don't go any further
         sys.exit(1)
 
+    if options.watch:
+        # keeps going until interrupted
+        try:
+            watchContent(SET_TXT_FILES, root, sources, getOutBase(options), options)
+        except ValueError, e:
+            logger.error(str(e))
+            sys.exit(1)
+
+    outpath = getOutPath(options)
+    mkdir_p(outpath)
+
+    try:
+        buildOutputs(root, outpath, options, metrics)
+    except ValueError, e:
+        # an option that doesn't fit the tree, found before any file is built
+        logger.error(str(e))
+        sys.exit(1)
+
+def getOutBase(options):
     # where we will store the output files
     if options.outpath:
-        outpath = options.outpath
-    else:
-        # home folder
-        outpath = expanduser("~")
+        return options.outpath
+    # home folder
+    return expanduser("~")
 
+def getOutPath(options):
+    outpath = getOutBase(options)
     if options.nooutdate:
-        outpath = "%s/%s" % (outpath, 'setter-out') 
-    else:
-        # append a date-centric folder to the path
-        mydate = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        outpath = "%s/%s-%s" % (outpath, mydate, 'setter-out') 
-
-    mkdir_p(outpath)
+        return "%s/%s" % (outpath, 'setter-out') 
+    # append a date-centric folder to the path
+    mydate = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    return "%s/%s-%s" % (outpath, mydate, 'setter-out') 
+
+def checkStreamOptions(options, args):
+    # --stream builds files while the single text file is still being read, so
+    # anything needing the whole tree first is out
+    if len(SET_TXT_FILES) > 1:
+        logger.error("--stream reads a single setter text file; more than one -i was given")
+        sys.exit(1)
+    if len(args):
+        logger.error("--stream can't be used with the %s command" % (args[0]))
+        sys.exit(1)
+    for flag, given in (('-C', options.checkoverlaps), ('-f', options.printfilenames),
+            ('-I', options.rangeindex), ('--only', options.only), ('-t', options.printtree),
+            ('-w', options.watch), ('-x', options.derive)):
+        if given:
+            logger.error("--stream can't be used with %s, which needs the whole tree first" % (flag))
+            sys.exit(1)
 
-    if not options.noset:
-        createSetFiles(root, outpath, options.setlevel)
+def streamOutputs(path, outpath, options, metrics):
+    # parse path and build each node's files as soon as its last line has been
+    # read, rather than parsing the whole file first; with -u -P -R, a node's
+    # blocks are dropped once its files are built
+    metrics.startPhase('stream')
+    manifestpath = "%s/%s" % (outpath, MANIFEST_FILENAME)
+    manifest = readManifest(manifestpath)
 
-    if not options.nolongpmap:
-        createPmapFiles(root, outpath, options.pmaplonglevel)
+    root = Node("root","")
+    streamer = None
+    unionpath = None
+    spooldir = None
+    try:
+        # union mode keeps the per-node local-only sets in a scratch folder
+        if options.unionsets and not options.noset:
+            unionpath = tempfile.mkdtemp(prefix='setter-union-')
 
-    if not options.noshortpmap:
-        # create with short names
-        createPmapFiles(root, outpath, options.pmapshortlevel, True)
+        # input text hashed at queue time waits here for its build
+        if not options.force:
+            spooldir = tempfile.mkdtemp(prefix='setter-input-')
 
-def createSetFiles(node, filepath, gotolevel):
+        streamer = StreamBuilder(outpath, options, manifest, unionpath, spooldir)
+        try:
+            Parser(path, root, options.pmapconcat, onclose=streamer.closeNode).parse()
+        finally:
+            streamer.finish()
+    finally:
+        metrics.endPhase()
+        if unionpath is not None:
+            shutil.rmtree(unionpath, True)
+        if spooldir is not None:
+            shutil.rmtree(spooldir, True)
+        if streamer is not None:
+            writeManifest(manifestpath, manifest, streamer.builds)
+            if options.metrics:
+                metrics.write(options.metrics, root, None, streamer.builds, (streamer.netblocks, streamer.addresses))
+    streamer.logResults(manifestpath)
+
+def buildOutputs(root, outpath, options, metrics, replace=False):
+    # create the set and pmap files under outpath, skipping those the manifest
+    # there shows are unchanged; returns (all builds, builds that ran, files
+    # written without a SiLK tool)
+    # replace removes an old output file before it is rebuilt, for folders
+    # whose files are hard links to a published build
+
+    # one walk of the tree shared by the set and both pmap passes
+    metrics.startPhase('aggregate')
+    aggregate = Aggregate(root)
+    metrics.endPhase()
+
+    # list every SiLK tool run, then queue them to be built
+    metrics.startPhase('queue')
+
+    # --only limits the files to some subtrees and their ancestors; checked
+    # before the scratch folder is made so a bad name leaves nothing behind
+    only = None
+    if options.only:
+        only = getOnlyNodes(root, options.only)
+
+    # -x sets are worked out and checked against the other file names up
+    # front too, for the same reason
+    derived = []
+    if options.derive:
+        taken = set()
+        if not options.noset:
+            fillSetFileNames(root, options.setlevel, only, taken)
+        derived = evaluateDerivedSets(root, options.derive, aggregate, taken)
+
+    builds = []
+    # files written here rather than by a SiLK tool
+    written = []
+    manifestpath = "%s/%s" % (outpath, MANIFEST_FILENAME)
+    manifest = readManifest(manifestpath)
+    buildqueue = None
+    unionpath = None
+    spooldir = None
+    try:
+        # union mode keeps the per-node local-only sets in a scratch folder
+        if options.unionsets and not options.noset:
+            unionpath = tempfile.mkdtemp(prefix='setter-union-')
+
+        if not options.noset:
+            createSetFiles(root, outpath, options.setlevel, aggregate, builds, unionpath, only)
+
+        if not options.nolongpmap:
+            createPmapFiles(root, outpath, options.pmaplonglevel, aggregate, builds, False, options.flattenpmaps, only)
+
+        if not options.noshortpmap:
+            # create with short names
+            createPmapFiles(root, outpath, options.pmapshortlevel, aggregate, builds, True, options.flattenpmaps, only)
+
+        if derived:
+            createDerivedSetFiles(outpath, derived, builds)
+
+        if options.rangeindex:
+            indexpath = "%s/%s.range-index" % (outpath, root.getFileName())
+            writeRangeIndex(indexpath, root, aggregate)
+            written.append(indexpath)
+        metrics.endPhase()
+
+        # each build is hashed, then skipped because the manifest shows its
+        # input is unchanged, linked to an identical output, or run
+        metrics.startPhase('build')
+        if not options.force:
+            # input text is kept while it is hashed so it isn't generated twice
+            spooldir = tempfile.mkdtemp(prefix='setter-input-')
+        buildqueue = BuildQueue(options, manifest, spooldir, False, replace)
+        try:
+            scratch = None
+            for build in builds:
+                if build.scratch:
+                    # only read by the union queued right after it
+                    scratch = build
+                    continue
+                buildqueue.queue(build, scratch)
+                scratch = None
+        finally:
+            buildqueue.finish()
+    finally:
+        metrics.endPhase()
+        if buildqueue is not None:
+            writeManifest(manifestpath, manifest, buildqueue.builds)
+        if unionpath is not None:
+            shutil.rmtree(unionpath, True)
+        if spooldir is not None:
+            shutil.rmtree(spooldir, True)
+        if options.metrics:
+            metrics.write(options.metrics, root, aggregate, builds)
+    buildqueue.logResults(manifestpath)
+    return (builds, buildqueue.queued, written)
+
+def watchContent(paths, root, sources, outpath, options):
+    # rebuild whenever one of the content files changes, and publish each
+    # finished build by pointing the outpath/setter-out symlink at it, so
+    # readers see the old files or the new ones but never a partial folder
+    # each build goes in its own dated folder next to the link, which starts
+    # as hard links to the published files so only changed files get built
+    linkpath = "%s/%s" % (outpath, 'setter-out')
+    mkdir_p(outpath)
+    if os.path.isdir(linkpath) and not os.path.islink(linkpath):
+        # an earlier -O run left a real folder here; make it the first build
+        genpath = getGenerationPath(outpath)
+        os.rename(linkpath, genpath)
+        publishOutput(genpath, linkpath)
+        logger.info("Moved %s to %s and linked it in its place" % (linkpath, genpath))
+
+    # the build before the published one is kept for readers still using it
+    retired = None
+    stamps = getSourceStamps(sources)
+    # -x and --only are checked against the first tree before watching starts
+    started = False
+    try:
+        while True:
+            if root is not None:
+                genpath = getGenerationPath(outpath)
+                published = False
+                try:
+                    stageOutput(linkpath, genpath)
+                    builds, queued, written = buildOutputs(root, genpath, options, Metrics(), True)
+                    stale = 0
+                    if not options.only:
+                        # with --only, files of nodes not built are still current
+                        stale = pruneOutput(genpath, builds, written)
+                    changed = len(queued)
+                    # files written in-process are rewritten every time, so
+                    # compare them with the published ones
+                    for path in written:
+                        current = os.path.join(linkpath, os.path.basename(path))
+                        if not os.path.isfile(current) or not filecmp.cmp(path, current, False):
+                            changed += 1
+                    if changed or stale:
+                        previous = None
+                        if os.path.islink(linkpath):
+                            previous = os.path.realpath(linkpath)
+                        publishOutput(genpath, linkpath)
+                        published = True
+                        logger.info("Published %d new and %d removed files in %s" % (changed, stale, genpath))
+                        if retired is not None:
+                            shutil.rmtree(retired, True)
+                        retired = previous
+                    else:
+                        logger.info("No output files changed")
+                except RuntimeError, e:
+                    logger.error("%s; keeping the published files" % (str(e)))
+                except ValueError, e:
+                    if not started:
+                        raise
+                    # an edit dropped a node -x or --only names; nothing was built
+                    logger.error("%s; keeping the published files until the content files are fixed" % (str(e)))
+                except Exception, e:
+                    # whatever went wrong, the published build is still whole
+                    logger.error("Could not build %s: %s; keeping the published files" % (genpath, str(e)))
+                finally:
+                    if not published:
+                        shutil.rmtree(genpath, True)
+                started = True
+
+            logger.info("Watching %d content files every %d seconds" % (len(sources), options.watch))
+            while getSourceStamps(sources) == stamps:
+                time.sleep(options.watch)
+
+            stamps = getSourceStamps(sources)
+            logger.info("Content changed; parsing %s" % (", ".join(paths)))
+            newsources = []
+            try:
+                root = loadTree(paths, options.pmapconcat, options.jobs, newsources)
+            except SystemExit:
+                # the parser logged why; wait for the next edit
+                logger.error("Keeping the published files until the content files are fixed")
+                root = None
+                continue
+            except Exception, e:
+                logger.error("Could not parse the content files: %s" % (str(e)))
+                logger.error("Keeping the published files until the content files are fixed")
+                root = None
+                continue
+            if newsources != sources:
+                # includes were added or dropped, so watch the new set of files
+                sources = newsources
+                stamps = getSourceStamps(sources)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
+        sys.exit(0)
+
+def getSourceStamps(paths):
+    # size and modification time of each file, compared between polls
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps.append((path, stat.st_size, stat.st_mtime))
+        except OSError:
+            stamps.append((path, None, None))
+    return stamps
+
+def getGenerationPath(outpath):
+    # same date-centric name a run without -O uses
+    mydate = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    genpath = "%s/%s-%s" % (outpath, mydate, 'setter-out')
+    count = 1
+    while os.path.lexists(genpath):
+        # more than one build within a second
+        genpath = "%s/%s-%d-%s" % (outpath, mydate, count, 'setter-out')
+        count += 1
+    return genpath
+
+def stageOutput(linkpath, genpath):
+    # start a new build folder as hard links to the published files (and their
+    # manifest), copying instead where links aren't possible
+    os.mkdir(genpath)
+    if not os.path.isdir(linkpath):
+        return
+    for name in os.listdir(linkpath):
+        source = os.path.join(linkpath, name)
+        if not os.path.isfile(source):
+            continue
+        try:
+            os.link(source, os.path.join(genpath, name))
+        except OSError:
+            shutil.copy2(source, os.path.join(genpath, name))
+
+def pruneOutput(genpath, builds, written=()):
+    # remove files carried over from the published folder for nodes that are no
+    # longer in the content files; returns how many were removed
+    keep = set([MANIFEST_FILENAME])
+    for path in written:
+        keep.add(os.path.basename(path))
+    for build in builds:
+        if not build.scratch:
+            keep.add(os.path.basename(build.filename))
+    removed = 0
+    for name in os.listdir(genpath):
+        if name not in keep:
+            os.remove(os.path.join(genpath, name))
+            removed += 1
+    return removed
+
+def publishOutput(genpath, linkpath):
+    # make a new link beside the old one and rename it over the old one, which
+    # is atomic, so the link always points at one complete folder
+    temppath = "%s.%d.tmp" % (linkpath, os.getpid())
+    if os.path.lexists(temppath):
+        os.remove(temppath)
+    os.symlink(os.path.basename(genpath), temppath)
+    os.rename(temppath, linkpath)
+
+def createSetFiles(node, filepath, gotolevel, aggregate, builds, unionpath=None, only=None):
+    # returns the build that produces this node's set file so a parent can depend on it
+    # only, if given, is the set of nodes to build files for (see getOnlyNodes)
+    if only is not None and node not in only:
+        return None
     if node.level <= gotolevel: 
-        setinfo = "#\n"
-        filename = "%s/%s.set" % (filepath, node.getFileName())
-        netblocklist = []
-        node.getNetblocks(netblocklist)
-        for item in netblocklist:
-            setinfo = setinfo + "%s/%d\n" % (item.startAddress, item.cidr)
-        args = ["rwsetbuild", "stdin", filename]
-        proc = subprocess.Popen(args, stdin=subprocess.PIPE)
-        proc.communicate(setinfo)
-        proc.wait()
-        if proc.returncode:
-            raise RuntimeError("Could not build IP set %s" % filename)
+        # a union needs every child's set built this run
+        if unionpath is None or not node.children or node.level == gotolevel or not isAllOnly(node.children, only):
+            build = makeSetBuild(node, filepath, aggregate)
+            builds.append(build)
+            for child in node.children:
+                createSetFiles(child, filepath, gotolevel, aggregate, builds, unionpath, only)
+            return build
+
+        # union mode: build the children first, then union their set files with
+        # a set of this node's own blocks instead of re-reading every descendant
+        depends = []
         for child in node.children:
-            createSetFiles(child, filepath, gotolevel)
+            depends.append(createSetFiles(child, filepath, gotolevel, aggregate, builds, unionpath, only))
+        local, build = makeUnionBuilds(node, filepath, aggregate, unionpath, depends)
+        if local is not None:
+            builds.append(local)
+        builds.append(build)
+        return build
+
+def makeSetBuild(node, filepath, aggregate):
+    # rwsetbuild fed every block of node and its descendants
+    filename = "%s/%s.set" % (filepath, node.getFileName())
+    args = ["rwsetbuild", "stdin", filename]
+    return Build(args, filename, "Could not build IP set %s" % filename,
+        getSetInfo, aggregate, node)
+
+def makeUnionBuilds(node, filepath, aggregate, unionpath, depends):
+    # returns (scratch build of node's own blocks or None, rwsettool union of
+    # it and depends, the children's set builds)
+    filename = "%s/%s.set" % (filepath, node.getFileName())
+    depends = list(depends)
+    local = None
+    if len(node.netblocks):
+        localname = "%s/%s.local-set" % (unionpath, node.getFileName())
+        args = ["rwsetbuild", "stdin", localname]
+        local = Build(args, localname, "Could not build IP set %s" % localname,
+            getSetInfo, aggregate, node, True)
+        local.scratch = True
+        depends.append(local)
+    args = ["rwsettool", "--union", "--output-path=%s" % filename]
+    for dependency in depends:
+        args.append(dependency.filename)
+    build = Build(args, filename, "Could not build IP set %s" % filename, None)
+    build.depends = depends
+    return (local, build)
+
+def getOnlyNodes(root, names):
+    # the nodes --only asks for: each named node's subtree plus its ancestors;
+    # names are file names as -f prints them (without .set), with or without
+    # the root's name in front; raises ValueError for a name no node has
+    nodes = {}
+    fillFileNameMap(root, nodes)
+    only = set()
+    for name in names:
+        node = nodes.get(name)
+        if node is None and root.getFileName():
+            node = nodes.get("%s-%s" % (root.getFileName(), name))
+        if node is None:
+            raise ValueError("No node has the file name '%s'; use -f to list them" % (name))
+        fillNodeSet(node, only)
+        while node.parent is not None:
+            node = node.parent
+            only.add(node)
+    return only
+
+def fillFileNameMap(node, nodes):
+    nodes[node.getFileName()] = node
+    for child in node.children:
+        fillFileNameMap(child, nodes)
+
+def fillNodeSet(node, nodes):
+    nodes.add(node)
+    for child in node.children:
+        fillNodeSet(child, nodes)
+
+def isAllOnly(nodes, only):
+    if only is None:
+        return True
+    for node in nodes:
+        if node not in only:
+            return False
+    return True
 
-def createPmapFiles(node, filepath, gotolevel, shortname=False):
+def fillSetFileNames(node, gotolevel, only, names):
+    # the file names (without .set) createSetFiles gives the tree's set files
+    if only is not None and node not in only:
+        return
+    if node.level <= gotolevel:
+        names.add(node.getFileName())
+        for child in node.children:
+            fillSetFileNames(child, gotolevel, only, names)
+
+def evaluateDerivedSets(root, specs, aggregate, taken):
+    # (name, ranges) for each -x NAME=EXPR; raises ValueError for a bad spec
+    # or a name already in taken, the set file names (without .set)
+    taken = set(taken)
+    derived = []
+    for spec in specs:
+        name, ranges = evaluateDerivedSet(spec, root, aggregate)
+        if name in taken:
+            raise ValueError("Derived set name '%s' would overwrite another output file: %s" % (name, spec))
+        taken.add(name)
+        derived.append((name, ranges))
+    return derived
+
+def createDerivedSetFiles(filepath, derived, builds):
+    # one set file per evaluated -x NAME=EXPR, built with a single rwsetbuild each
+    for name, ranges in derived:
+        filename = "%s/%s.set" % (filepath, name)
+        addresses = 0
+        for first, last in ranges:
+            addresses += last - first + 1
+        logger.info("Derived set %s has %d addresses in %d ranges" % (name, addresses, len(ranges)))
+        args = ["rwsetbuild", "stdin", filename]
+        builds.append(Build(args, filename, "Could not build derived set %s" % filename,
+            getDerivedSetInfo, ranges))
+
+def writeRangeIndex(path, root, aggregate):
+    # the tree's flattened ranges in the RangeIndex layout, with each node's
+    # labels stored once; written then renamed so readers never see a partial file
+    starts = array.array('I')
+    ends = array.array('I')
+    labelids = array.array('I')
+    nodeids = {}
+    labels = []
+    for first, last, node in flattenNetblocks(aggregate.getSortedNetblocks(root), getNodeLabel):
+        if node not in nodeids:
+            nodeids[node] = len(labels)
+            labels.append("\0".join((node.getPmapName(), node.getFileName(), node.getPath())))
+        starts.append(first)
+        ends.append(last)
+        labelids.append(nodeids[node])
+    offsets = array.array('I', [0])
+    for label in labels:
+        offsets.append(offsets[-1] + len(label))
+    labeloffset = RANGE_INDEX_HEADER.size + 12 * len(starts)
+    labelsize = 4 * len(offsets) + offsets[-1]
+    # array uses native order and 'I' is 4 bytes on the platforms SiLK runs on
+    if sys.byteorder == 'big':
+        for values in (starts, ends, labelids, offsets):
+            values.byteswap()
+
+    temppath = "%s.tmp" % (path)
+    indexFile = tryOpen(temppath, 'w')
+    indexFile.write(RANGE_INDEX_HEADER.pack(RANGE_INDEX_MAGIC, RANGE_INDEX_VERSION, len(starts),
+        len(labels), labeloffset, labelsize, 0))
+    starts.tofile(indexFile)
+    ends.tofile(indexFile)
+    labelids.tofile(indexFile)
+    offsets.tofile(indexFile)
+    indexFile.write("".join(labels))
+    tryClose(indexFile)
+    os.rename(temppath, path)
+    logger.info("Wrote range index %s with %d ranges and %d labels" % (path, len(starts), len(labels)))
+
+def getDerivedSetInfo(ranges):
+    # yields the rwsetbuild input one line at a time, header first
+    yield "#\n"
+    for first, last in ranges:
+        for start, cidr in rangeToCidrs(first, last):
+            yield "%s/%d\n" % (intToIp(start), cidr)
+
+def evaluateDerivedSet(spec, root, aggregate):
+    # NAME=EXPR, where EXPR is node paths (short names from the top level down
+    # joined by /, as Node.getPath gives them) or cidr blocks
+    # joined by space-separated operators, applied left to right:
+    #   &  addresses in both    |  addresses in either    -  addresses in the left only
+    # e.g., unassigned=10.0.0.0/8 - my_mssp/customers
+    # returns (name, ascending (first, last) ranges); raises ValueError if
+    # spec doesn't parse or names a node the tree doesn't have
+    parts = spec.split('=', 1)
+    if len(parts) != 2 or not parts[0].strip() or not parts[1].strip():
+        raise ValueError("Derived set must be NAME=EXPRESSION: %s" % (spec))
+    name = parts[0].strip()
+    for char in name:
+        if char not in "abcdefghijklmnopqrstuvwxyz0123456789-_.":
+            raise ValueError("Derived set name may only use a-z, 0-9, '-', '_' and '.': %s" % (spec))
+
+    nodes = {}
+    fillPathMap(root, nodes)
+    tokens = parts[1].split()
+    if len(tokens) % 2 == 0:
+        raise ValueError("Derived set expression must alternate operands and operators (&, |, -) separated by spaces: %s" % (spec))
+    ranges = getOperandRanges(tokens[0], spec, nodes, aggregate)
+    for position in range(1, len(tokens), 2):
+        operator = tokens[position]
+        operand = getOperandRanges(tokens[position + 1], spec, nodes, aggregate)
+        if operator == '&':
+            ranges = intersectRanges(ranges, operand)
+        elif operator == '|':
+            ranges = mergeRanges(ranges + operand)
+        elif operator == '-':
+            ranges = subtractRanges(ranges, operand)
+        else:
+            raise ValueError("Unknown derived set operator '%s'; use &, |, or -: %s" % (operator, spec))
+    return (name, ranges)
+
+def fillPathMap(node, nodes):
+    nodes[node.getPath()] = node
+    for child in node.children:
+        fillPathMap(child, nodes)
+
+def getOperandRanges(operand, spec, nodes, aggregate):
+    # a node's addresses, including its descendants' like its set file, or a cidr block
+    if operand in nodes:
+        ranges = []
+        for netblock in aggregate.getNetblocks(nodes[operand]):
+            for block in netblock.getCoverNetblocks():
+                first = block.start & getCidrMask(block.cidr)
+                ranges.append((first, getLastAddress(first, block.cidr)))
+        return mergeRanges(ranges)
+    parts = operand.split('/')
+    try:
+        first = ipToInt(parts[0])
+        if len(parts) == 1:
+            cidr = 32
+        elif len(parts) == 2 and 0 <= int(parts[1]) <= 32:
+            cidr = int(parts[1])
+        else:
+            raise ValueError(operand)
+    except ValueError:
+        raise ValueError("Derived set operand '%s' is neither a node path nor a cidr block: %s" % (operand, spec))
+    first = first & getCidrMask(cidr)
+    return [(first, getLastAddress(first, cidr))]
+
+def mergeRanges(ranges):
+    # sorts (first, last) ranges and joins the ones that overlap or touch
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+def intersectRanges(left, right):
+    # both ascending and non-overlapping, as mergeRanges returns them
+    result = []
+    leftindex = 0
+    rightindex = 0
+    while leftindex < len(left) and rightindex < len(right):
+        first = max(left[leftindex][0], right[rightindex][0])
+        last = min(left[leftindex][1], right[rightindex][1])
+        if first <= last:
+            result.append((first, last))
+        # drop whichever range ends first
+        if left[leftindex][1] < right[rightindex][1]:
+            leftindex += 1
+        else:
+            rightindex += 1
+    return result
+
+def subtractRanges(left, right):
+    # both ascending and non-overlapping, as mergeRanges returns them
+    result = []
+    rightindex = 0
+    for first, last in left:
+        while rightindex < len(right) and right[rightindex][1] < first:
+            rightindex += 1
+        position = rightindex
+        while first <= last and position < len(right) and right[position][0] <= last:
+            if right[position][0] > first:
+                result.append((first, right[position][0] - 1))
+            first = max(first, right[position][1] + 1)
+            position += 1
+        if first <= last:
+            result.append((first, last))
+    return result
+
+def createPmapFiles(node, filepath, gotolevel, aggregate, builds, shortname=False, flatten=False, only=None):
+    if only is not None and node not in only:
+        return
     if node.level <= gotolevel: 
-        pmapinfo = "map-name setter\nmode ip\n"
-        nodefilename = node.getFileName()
+        builds.append(makePmapBuild(node, filepath, aggregate, shortname, flatten))
+        for child in node.children:
+            createPmapFiles(child, filepath, gotolevel, aggregate, builds, shortname, flatten, only)
+
+def makePmapBuild(node, filepath, aggregate, shortname=False, flatten=False):
+    nodefilename = node.getFileName()
+    if shortname:
+        filename = "%s/%s.short-pmap" % (filepath, nodefilename)
+    else:
+        filename = "%s/%s.long-pmap" % (filepath, nodefilename)
+    args = ["rwpmapbuild", "--input-file", "stdin", "--output-file", filename]
+    return Build(args, filename, "Could not build pmap %s" % filename,
+        getPmapInfo, aggregate, node, shortname, flatten)
+
+def getSetInfo(aggregate, node, localOnly=False):
+    # yields the rwsetbuild input one line at a time, header first
+    yield "#\n"
+    if localOnly:
+        netblocklist = node.netblocks
+    else:
+        netblocklist = aggregate.getNetblocks(node)
+    for netblock in netblocklist:
+        for item in netblock.getCoverNetblocks():
+            yield "%s/%d\n" % (intToIp(item.start), item.cidr)
+
+def getPmapInfo(aggregate, node, shortname=False, flatten=False):
+    # yields the rwpmapbuild input one line at a time, header first as one item
+    yield "map-name setter\nmode ip\n"
+    # sorted by cidr with most granular on bottom
+    netblocklist = aggregate.getSortedNetblocks(node)
+    if flatten:
+        # precedence already resolved, so each address appears once; ranges
+        # that aren't a single cidr block use rwpmapbuild's "low high label"
+        # form, unless the label could be mistaken for the high address
+        lines = []
         if shortname:
-            filename = "%s/%s.short-pmap" % (filepath, nodefilename)
+            getLabel = getPmapShortLabel
         else:
-            filename = "%s/%s.long-pmap" % (filepath, nodefilename)
-        netblocklist = []
-        node.getNetblocks(netblocklist)
-        # sort this by cidr with most granular on bottom
-        for item in sorted(netblocklist, key=lambda block: block.cidr):
-            if shortname:
-                pmapinfo = pmapinfo + "%s/%d %s\n" % (item.startAddress, item.cidr, item.pmapShortName)
+            getLabel = getPmapLabel
+        for first, last, label in flattenNetblocks(netblocklist, getLabel):
+            blocks = rangeToCidrs(first, last)
+            if len(blocks) == 1 or isAddressLikeLabel(label):
+                for start, cidr in blocks:
+                    lines.append("%s/%d %s\n" % (intToIp(start), cidr, label))
             else:
-                pmapinfo = pmapinfo + "%s/%d %s\n" % (item.startAddress, item.cidr, item.pmapName)
-        args = ["rwpmapbuild", "--input-file", "stdin", "--output-file", filename]
-        proc = subprocess.Popen(args, stdin=subprocess.PIPE)
-        proc.communicate(pmapinfo)
-        proc.wait()
-        if proc.returncode:
-            raise RuntimeError("Could not build pmap %s" % filename)
-        for child in node.children:
-            createPmapFiles(child, filepath, gotolevel, shortname)
+                lines.append("%s %s %s\n" % (intToIp(first), intToIp(last), label))
+        # many small blocks scattered through a big one take two ranges per
+        # hole once flattened, so only use the result when it is smaller
+        count = 0
+        for netblock in netblocklist:
+            count += netblock.getCount()
+        if len(lines) <= count:
+            for line in lines:
+                yield line
+            return
+    for netblock in netblocklist:
+        if shortname:
+            label = netblock.getPmapShortName()
+        else:
+            label = netblock.getPmapName()
+        for item in netblock.getNetblocks():
+            yield "%s/%d %s\n" % (intToIp(item.start), item.cidr, label)
+
+def getPmapLabel(netblock):
+    return netblock.getPmapName()
+
+def getPmapShortLabel(netblock):
+    return netblock.getPmapShortName()
+
+def getNodeLabel(netblock):
+    return netblock.node
+
+def getOwnerLabel(netblock):
+    return (netblock.node.getPath(), netblock.getPmapName())
+
+def flattenNetblocks(netblocklist, getLabel):
+    # resolves which label rwpmapbuild would give each address when fed
+    # netblocklist in order (later entries win where they overlap) and returns
+    # the result as ascending (first, last, label) ranges that don't overlap,
+    # with touching ranges of the same label merged; getLabel(netblock) gives
+    # the label, which only needs to support ==
+    # each entry is (first address, cidr, order, label); cidr blocks either nest
+    # or don't touch, so this sorts enclosing blocks ahead of the ones they
+    # enclose, and the one that wins over a stretch is the innermost still open
+    entries = []
+    for order, netblock in enumerate(netblocklist):
+        label = getLabel(netblock)
+        for block in netblock.getNetblocks():
+            entries.append((block.start & getCidrMask(block.cidr), block.cidr, order, label))
+    entries.sort()
+
+    ranges = []
+    def addRange(first, last, label):
+        if ranges and ranges[-1][2] == label and ranges[-1][1] + 1 == first:
+            ranges[-1] = (ranges[-1][0], last, label)
+        else:
+            ranges.append((first, last, label))
+
+    # (last address, label) of the blocks still open, innermost on top, and the
+    # first address not yet given a label
+    stack = []
+    position = 0
+    for first, cidr, order, label in entries:
+        while stack and stack[-1][0] < first:
+            last, outerlabel = stack.pop()
+            if position <= last:
+                addRange(position, last, outerlabel)
+                position = last + 1
+        if stack and position < first:
+            addRange(position, first - 1, stack[-1][1])
+        position = first
+        stack.append((getLastAddress(first, cidr), label))
+    while stack:
+        last, outerlabel = stack.pop()
+        if position <= last:
+            addRange(position, last, outerlabel)
+            position = last + 1
+    return ranges
+
+def isAddressLikeLabel(label):
+    # whether rwpmapbuild might read the label's first word as an address,
+    # including integer and IPv6 forms
+    words = label.split(None, 1)
+    return bool(words) and (words[0][:1].isdigit() or ':' in words[0])
+
+def setReuse(build, outputs, cachedir=None):
+    # outputs maps input hashes to the output file (or queued build) that has
+    # them; build is added to it if its own output will be the first
+    digest = build.getDigest()
+    source = outputs.get(digest)
+    if isinstance(source, Build):
+        # wait for it to be built
+        build.reuse = source.filename
+        build.depends = [source]
+        return
+    if source is not None:
+        build.reuse = source
+        build.depends = []
+        return
+    if cachedir is not None:
+        cachepath = getReusePath(cachedir, build)
+        if os.path.isfile(cachepath):
+            build.reuse = cachepath
+            build.depends = []
+            outputs[digest] = cachepath
+            return
+        build.cachepath = cachepath
+    outputs[digest] = build
+
+def getReusePath(cachedir, build):
+    # the extension only makes the cache folder easier to look through
+    return "%s/%s%s" % (cachedir, build.getDigest(), os.path.splitext(build.filename)[1])
+
+def isBuildCurrent(build, manifest, spooldir=None):
+    # whether the output file exists and was built from the same input
+    digest = build.getDigest(spooldir)
+    return manifest.get(os.path.basename(build.filename)) == digest and os.path.isfile(build.filename)
+
+def readManifest(path):
+    # manifest lines are "digest  filename", like sha1sum output
+    manifest = {}
+    if not os.path.isfile(path):
+        return manifest
+    manifestFile = tryOpen(path, 'r')
+    for line in manifestFile:
+        parts = line.strip().split(None, 1)
+        if len(parts) == 2:
+            manifest[parts[1]] = parts[0]
+    tryClose(manifestFile)
+    return manifest
+
+def writeManifest(path, manifest, builds):
+    # record builds that succeeded this run and drop failed or interrupted ones
+    # so they are rebuilt next time; skipped and never-started builds keep
+    # whatever entry they already had
+    for build in builds:
+        if build.scratch:
+            continue
+        name = os.path.basename(build.filename)
+        if build.returncode == 0:
+            if os.path.isfile(build.filename):
+                manifest[name] = build.getDigest()
+        elif build.proc is not None and name in manifest:
+            del manifest[name]
+    names = manifest.keys()
+    names.sort()
+    # write then rename so a crash never leaves a half-written manifest
+    temppath = "%s.tmp" % (path)
+    manifestFile = tryOpen(temppath, 'w')
+    for name in names:
+        manifestFile.write("%s  %s\n" % (manifest[name], name))
+    tryClose(manifestFile)
+    os.rename(temppath, path)
+
+def writeLines(fileref, lines, chunksize=65536, counts=None):
+    # write lines in chunks of roughly chunksize bytes so only one chunk is
+    # ever held in memory; counts, if given, gets [items, bytes] written so far
+    if counts is None:
+        counts = [0, 0]
+    chunk = []
+    chunklen = 0
+    for line in lines:
+        chunk.append(line)
+        chunklen += len(line)
+        if chunklen >= chunksize:
+            fileref.write("".join(chunk))
+            counts[0] += len(chunk)
+            counts[1] += chunklen
+            chunk = []
+            chunklen = 0
+    if chunk:
+        fileref.write("".join(chunk))
+        counts[0] += len(chunk)
+        counts[1] += chunklen
+    return counts
+
+def runBuild(build):
+    # returns the tool's exit status
+    started = time.time()
+    if build.reuse is not None:
+        logger.debug("Linking %s to identical output %s" % (build.filename, build.reuse))
+        build.dropSpool()
+        try:
+            linkOutput(build.reuse, build.filename)
+            build.returncode = 0
+        except (IOError, OSError), e:
+            logger.error("Could not reuse %s for %s: %s" % (build.reuse, build.filename, str(e)))
+            build.returncode = 1
+        build.seconds = time.time() - started
+        return build.returncode
+
+    # an old output may be a link shared with other files, which the tool
+    # must not write through
+    if os.path.isfile(build.filename) and os.stat(build.filename).st_nlink > 1:
+        os.remove(build.filename)
+    logger.debug("Running %s" % (" ".join(build.args)))
+    brokenpipe = False
+    digest = None
+    if build.spool is not None:
+        # the text saved while hashing; the tool reads it straight from the file
+        spoolFile = open(build.spool, 'rb')
+        try:
+            proc = subprocess.Popen(build.args, stdin=spoolFile)
+            build.proc = proc
+        finally:
+            spoolFile.close()
+        build.records = max(build.spoolcounts[0] - 1, 0)
+        build.bytes = build.spoolcounts[1]
+        build.dropSpool()
+    elif build.inputfunc is None:
+        proc = subprocess.Popen(build.args)
+        build.proc = proc
+    else:
+        proc = subprocess.Popen(build.args, stdin=subprocess.PIPE)
+        build.proc = proc
+        counts = [0, 0]
+        lines = build.getInput()
+        if build.digest is None:
+            # not hashed beforehand (--force), so hash it on the way to the tool
+            digest = hashlib.sha1(build.args[0])
+            lines = hashLines(lines, digest)
+        try:
+            try:
+                writeLines(proc.stdin, lines, counts=counts)
+            finally:
+                proc.stdin.close()
+                # every input starts with its header as a single item
+                build.records = max(counts[0] - 1, 0)
+                build.bytes = counts[1]
+        except IOError, e:
+            # the tool quit before reading all its input; its exit status
+            # (or this) says why
+            if e.errno != errno.EPIPE:
+                raise
+            brokenpipe = True
+    proc.wait()
+    build.seconds = time.time() - started
+    build.returncode = proc.returncode
+    if digest is not None and not brokenpipe:
+        build.digest = digest.hexdigest()
+    if brokenpipe:
+        logger.error("%s stopped reading its input while building %s" % (build.args[0], build.filename))
+        if not build.returncode:
+            build.returncode = 1
+    if not build.returncode and build.cachepath is not None:
+        try:
+            linkOutput(build.filename, build.cachepath)
+        except (IOError, OSError), e:
+            logger.warning("Could not save %s to reuse cache: %s" % (build.filename, str(e)))
+    return build.returncode
+
+def hashLines(lines, digest):
+    # passes lines through, adding each to digest on the way
+    for line in lines:
+        digest.update(line)
+        yield line
+
+def linkOutput(source, target):
+    # hard link target to source, copying instead where links aren't possible;
+    # made under a temporary name and renamed so target is never partial
+    temppath = "%s.%d.tmp" % (target, os.getpid())
+    try:
+        os.link(source, temppath)
+    except OSError:
+        shutil.copy2(source, temppath)
+    os.rename(temppath, target)
+
+def runBuilds(builds, jobs=1):
+    # run the queued SiLK tool invocations, at most jobs at a time
+    # builds are queued with their dependencies ahead of them, and a build is
+    # only dispatched once everything it depends on has finished
+    # the first failure stops any further dispatch, stops builds still running,
+    # and is the one reported back
+    if jobs <= 1:
+        for build in builds:
+            if runBuild(build):
+                raise RuntimeError(build.failmsg)
+        return
+
+    pipeline = BuildPipeline(min(jobs, len(builds)))
+    try:
+        for build in builds:
+            pipeline.submit(build)
+    finally:
+        pipeline.finish()
+
+def getLookupAddresses(lookupargs):
+    # yields addresses from comma-separated args, files of addresses, or stdin
+    # when no args (or '-') are given
+    if not len(lookupargs):
+        lookupargs = ['-']
+    for arg in lookupargs:
+        if arg == '-':
+            lines = sys.stdin
+        elif os.path.isfile(arg):
+            lines = tryOpen(arg, 'r')
+        else:
+            lines = [arg]
+        for line in lines:
+            if '#' in line:
+                line = line.split('#')[0]
+            for address in line.split(','):
+                address = address.strip()
+                if address:
+                    yield address
+        if lines is not sys.stdin and not isinstance(lines, list):
+            tryClose(lines)
+
+def doLookup(root, lookupargs):
+    # print address|long name|short name|node path for each address
+    index = LookupIndex(root)
+    for address in getLookupAddresses(lookupargs):
+        try:
+            sys.stdout.write(formatLookup(index, address))
+        except ValueError:
+            logger.warning("Skipping lookup of invalid IPv4 address: %s" % (address))
+
+def formatLookup(index, address, quiet=False):
+    # raises ValueError for an invalid address unless quiet, which answers it
+    # like an address that isn't in the tree
+    try:
+        node = index.lookup(address)
+    except ValueError:
+        if not quiet:
+            raise
+        node = None
+    if node is None:
+        return "%s|||\n" % (address)
+    return "%s|%s|%s|%s\n" % (address, node.getPmapName(), node.getFileName(), node.getPath())
+
+def doClassify(root, classifyargs, chunksize=65536):
+    # print address,long name,short name for each address in the files (or
+    # stdin), one per line, reading and labeling chunksize lines at a time;
+    # addresses that aren't in the tree or aren't valid get empty names
+    classifier = RangeClassifier(root)
+    if not len(classifyargs):
+        classifyargs = ['-']
+    total = 0
+    invalid = 0
+    for arg in classifyargs:
+        if arg == '-':
+            lines = sys.stdin
+        else:
+            checkFile(arg)
+            lines = tryOpen(arg, 'r')
+        while True:
+            chunk = list(itertools.islice(lines, chunksize))
+            if not chunk:
+                break
+            addresses = []
+            numbers = []
+            bad = []
+            for line in chunk:
+                address = line.strip()
+                if not address or address.startswith('#'):
+                    continue
+                try:
+                    # inet_pton is strict and fast; ipToInt also takes the
+                    # zero-padded quads the content file allows
+                    number = struct.unpack('!I', socket.inet_pton(socket.AF_INET, address))[0]
+                except socket.error:
+                    try:
+                        number = ipToInt(address)
+                    except ValueError:
+                        number = 0
+                        bad.append(len(addresses))
+                addresses.append(address)
+                numbers.append(number)
+            output = []
+            for address, label in zip(addresses, classifier.classify(numbers)):
+                output.append(address + label)
+            for position in bad:
+                output[position] = addresses[position] + ",,\n"
+            sys.stdout.write("".join(output))
+            total += len(addresses)
+            invalid += len(bad)
+        if lines is not sys.stdin:
+            tryClose(lines)
+    if invalid:
+        logger.warning("%d of %d addresses were not valid IPv4 addresses" % (invalid, total))
+    logger.info("Classified %d addresses" % (total))
+
+def doExportSqlite(root, sources, exportargs):
+    # write the tree to an indexed SQLite database:
+    #   nodes: id (pre-order position), parent_id, level, name, long_name, path,
+    #     file_name, pmap_name, and last_descendant_id, so a node's subtree is
+    #     id BETWEEN its id AND its last_descendant_id
+    #   netblocks: node_id, start, end (inclusive), cidr, source, line; one row
+    #     per net block a content line expands to, under the node that lists it
+    #   ranges: start, end, node_id; the non-overlapping ranges each node wins,
+    #     like lookup and the pmap files use
+    #   meta: key, value
+    if len(exportargs) != 1:
+        logger.error("The export-sqlite command needs the path of the database to write")
+        sys.exit(1)
+    dbpath = exportargs[0]
+
+    nodes = []
+    fillNodeList(root, nodes)
+    nodeids = {}
+    for nodeid, node in enumerate(nodes):
+        nodeids[node] = nodeid
+
+    # write then rename so readers never see a partial database
+    temppath = "%s.%d.tmp" % (dbpath, os.getpid())
+    if os.path.exists(temppath):
+        os.remove(temppath)
+    connection = sqlite3.connect(temppath)
+    try:
+        connection.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE nodes (id INTEGER PRIMARY KEY, parent_id INTEGER REFERENCES nodes(id),
+                level INTEGER, name TEXT, long_name TEXT, path TEXT, file_name TEXT,
+                pmap_name TEXT, last_descendant_id INTEGER);
+            CREATE TABLE netblocks (id INTEGER PRIMARY KEY, node_id INTEGER REFERENCES nodes(id),
+                start INTEGER, end INTEGER, cidr INTEGER, source TEXT, line INTEGER);
+            CREATE TABLE ranges (start INTEGER PRIMARY KEY, end INTEGER, node_id INTEGER REFERENCES nodes(id));
+        """)
+        connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ('version', version),
+            ('created', datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+            ('sources', "\n".join(sources)),
+        ])
+        noderows = []
+        for nodeid, node in enumerate(nodes):
+            parentid = None
+            if node.parent is not None:
+                parentid = nodeids[node.parent]
+            noderows.append((nodeid, parentid, node.level, node.name, node.longName, node.getPath(),
+                node.getFileName(), node.getPmapName(), nodeids[getLastDescendant(node)]))
+        connection.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", noderows)
+        connection.executemany("INSERT INTO netblocks (node_id, start, end, cidr, source, line) VALUES (?, ?, ?, ?, ?, ?)",
+            getNetblockRows(nodes, nodeids))
+        aggregate = Aggregate(root)
+        rangerows = []
+        for first, last, node in flattenNetblocks(aggregate.getSortedNetblocks(root), getNodeLabel):
+            rangerows.append((first, last, nodeids[node]))
+        connection.executemany("INSERT INTO ranges VALUES (?, ?, ?)", rangerows)
+        connection.executescript("""
+            CREATE INDEX nodes_parent ON nodes (parent_id);
+            CREATE INDEX nodes_path ON nodes (path);
+            CREATE INDEX nodes_name ON nodes (name);
+            CREATE INDEX nodes_level ON nodes (level);
+            CREATE INDEX netblocks_node ON netblocks (node_id);
+            CREATE INDEX netblocks_start ON netblocks (start, end);
+        """)
+        connection.commit()
+    finally:
+        connection.close()
+    os.rename(temppath, dbpath)
+    logger.info("Wrote %d nodes and %d ranges to %s" % (len(nodes), len(rangerows), dbpath))
+
+def fillNodeList(node, nodes):
+    # pre-order, so each subtree is a contiguous run
+    nodes.append(node)
+    for child in node.children:
+        fillNodeList(child, nodes)
+
+def getLastDescendant(node):
+    while node.children:
+        node = node.children[-1]
+    return node
+
+def getNetblockRows(nodes, nodeids):
+    # yields (node id, start, end, cidr, source, line) for every expanded block
+    for node in nodes:
+        for netblock in node.netblocks:
+            for block in netblock.getNetblocks():
+                first = block.start & getCidrMask(block.cidr)
+                yield (nodeids[node], first, getLastAddress(first, block.cidr), block.cidr,
+                    block.source, block.line)
+
+def doServe(root, sources, serveargs, paths, options):
+    # answer lookups over a Unix socket until interrupted, reloading the index
+    # whenever the content files change; requests keep being answered from the
+    # old index while the new one is built
+    if len(serveargs) > 1:
+        logger.error("The serve command takes at most one argument, the socket path")
+        sys.exit(1)
+    if serveargs:
+        socketpath = serveargs[0]
+    else:
+        socketpath = "%s/%s" % (expanduser("~"), 'setter-lookup.sock')
+    if os.path.exists(socketpath):
+        removeStaleSocket(socketpath)
+
+    server = LookupServer(socketpath, LookupIndex(root))
+    interval = options.watch or 5
+    reloader = threading.Thread(target=reloadIndex, args=(server, paths, sources, interval, options))
+    reloader.setDaemon(True)
+    reloader.start()
+
+    logger.info("Serving lookups on %s; checking %d content files every %d seconds" % (socketpath, len(sources), interval))
+    try:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Stopped serving")
+    finally:
+        server.server_close()
+        os.remove(socketpath)
+
+def removeStaleSocket(socketpath):
+    # a socket left by a server that died can be reused; a live one can't
+    if not stat.S_ISSOCK(os.stat(socketpath).st_mode):
+        logger.error("Socket path exists and is not a socket: %s" % (socketpath))
+        sys.exit(1)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            probe.connect(socketpath)
+        except socket.error:
+            logger.debug("Removing stale socket %s" % (socketpath))
+            os.remove(socketpath)
+            return
+    finally:
+        probe.close()
+    logger.error("Another setter is already serving on %s" % (socketpath))
+    sys.exit(1)
+
+def reloadIndex(server, paths, sources, interval, options):
+    # runs in its own thread; swapping server.index is a single assignment, so
+    # each request sees either the old index or the new one
+    stamps = getSourceStamps(sources)
+    while True:
+        time.sleep(interval)
+        if getSourceStamps(sources) == stamps:
+            continue
+        stamps = getSourceStamps(sources)
+        logger.info("Content changed; parsing %s" % (", ".join(paths)))
+        newsources = []
+        try:
+            root = loadContent(paths, options, newsources)
+            index = LookupIndex(root)
+        except SystemExit:
+            # the parser logged why; wait for the next edit
+            logger.error("Keeping the current index until the content files are fixed")
+            continue
+        except Exception, e:
+            # anything else the content trips up must not end this thread
+            logger.error("Could not reload the content files: %s" % (str(e)))
+            logger.error("Keeping the current index until the content files are fixed")
+            continue
+        server.index = index
+        logger.info("Reloaded the lookup index")
+        if newsources != sources:
+            sources = newsources
+            stamps = getSourceStamps(sources)
+
+def diffRanges(oldranges, newranges):
+    # compares two lists of ascending, non-overlapping (first, last, label)
+    # ranges and returns (first, last, old label, new label) for each stretch
+    # where they differ, None meaning unlabeled; touching stretches with the
+    # same change are merged
+    points = set()
+    for first, last, label in oldranges + newranges:
+        points.add(first)
+        points.add(last + 1)
+    points = sorted(points)
+
+    changes = []
+    oldindex = 0
+    newindex = 0
+    for position in range(len(points) - 1):
+        first = points[position]
+        last = points[position + 1] - 1
+        while oldindex < len(oldranges) and oldranges[oldindex][1] < first:
+            oldindex += 1
+        while newindex < len(newranges) and newranges[newindex][1] < first:
+            newindex += 1
+        old = None
+        if oldindex < len(oldranges) and oldranges[oldindex][0] <= first:
+            old = oldranges[oldindex][2]
+        new = None
+        if newindex < len(newranges) and newranges[newindex][0] <= first:
+            new = newranges[newindex][2]
+        if old == new:
+            continue
+        if changes and changes[-1][1] + 1 == first and changes[-1][2] == old and changes[-1][3] == new:
+            changes[-1] = (changes[-1][0], last, old, new)
+        else:
+            changes.append((first, last, old, new))
+    return changes
+
+def getOwnerRanges(root):
+    # the node (path and pmap name) each address ends up labeled with
+    aggregate = Aggregate(root)
+    return flattenNetblocks(aggregate.getSortedNetblocks(root), getOwnerLabel)
+
+def formatRange(first, last):
+    # a cidr block when the range is one, otherwise setter's start-end form
+    blocks = rangeToCidrs(first, last)
+    if len(blocks) == 1:
+        return "%s/%d" % (intToIp(first), blocks[0][1])
+    return "%s-%s" % (intToIp(first), intToIp(last))
+
+def doDiff(diffargs, paths, options):
+    # print change|range|old path|old pmap name|new path|new pmap name for
+    # each stretch of addresses whose node differs between two content files;
+    # returns the number of changes
+    if len(diffargs) == 2:
+        oldpaths = [diffargs[0]]
+        newpaths = [diffargs[1]]
+    elif len(diffargs) == 1:
+        oldpaths = [diffargs[0]]
+        newpaths = paths
+    else:
+        logger.error("The diff command needs the old setter text file and, optionally, the new one (default is the -i files)")
+        sys.exit(1)
+    for path in oldpaths + newpaths:
+        checkFile(path)
+
+    oldranges = getOwnerRanges(loadContent(oldpaths, options))
+    newranges = getOwnerRanges(loadContent(newpaths, options))
+    changes = diffRanges(oldranges, newranges)
+
+    counts = {'added': 0, 'removed': 0, 'relabeled': 0}
+    addresses = 0
+    for first, last, old, new in changes:
+        if old is None:
+            change = 'added'
+            old = ('', '')
+        elif new is None:
+            change = 'removed'
+            new = ('', '')
+        else:
+            change = 'relabeled'
+        counts[change] += 1
+        addresses += last - first + 1
+        sys.stdout.write("%s|%s|%s|%s|%s|%s\n" % (change, formatRange(first, last), old[0], old[1], new[0], new[1]))
+    logger.info("%d added, %d removed, and %d relabeled ranges covering %d addresses" % (
+        counts['added'], counts['removed'], counts['relabeled'], addresses))
+    return len(changes)
+
+def findOverlaps(root):
+    # returns (earlier, later) netblock pairs from different nodes that claim
+    # the same addresses; for every pair, later's label is the one the pmap
+    # uses across later's addresses
+    # each entry is (first address, cidr, pre-order position, variant, netblock),
+    # which sorts enclosing blocks ahead of the blocks they enclose and otherwise
+    # follows the order rwpmapbuild applies them in
+    entries = []
+    aggregate = Aggregate(root)
+    for position, netblock in enumerate(aggregate.netblocks):
+        variant = 0
+        for block in netblock.getNetblocks():
+            entries.append((block.start & getCidrMask(block.cidr), block.cidr, position, variant, block))
+            variant += 1
+    entries.sort()
+
+    # cidr blocks either nest or don't touch, so the blocks still open during
+    # the sweep form a stack with each one enclosing the next
+    overlaps = []
+    stack = []
+    for entry in entries:
+        first = entry[0]
+        block = entry[4]
+        while stack and getLastAddress(stack[-1][0], stack[-1][1]) < first:
+            stack.pop()
+        for other in stack:
+            if other[4].node is not block.node:
+                overlaps.append((other[4], block))
+        stack.append(entry)
+    return overlaps
+
+def printOverlaps(overlaps):
+    # returns the number of overlaps reported
+    for earlier, later in overlaps:
+        print "%s/%d (%s line %s, %s) overlaps %s/%d (%s line %s, %s); pmap label there is '%s' (%s)" % (
+            earlier.getStartAddress(), earlier.cidr, earlier.source, earlier.line, earlier.node.getPath(),
+            later.getStartAddress(), later.cidr, later.source, later.line, later.node.getPath(),
+            later.getPmapName(), later.getPmapShortName())
+    if overlaps:
+        logger.warning("Found %d overlapping net block pairs in different nodes" % (len(overlaps)))
+    else:
+        logger.info("No overlapping net blocks found between nodes")
+    return len(overlaps)
+
+def getNetblockTotals(netblocklist):
+    # (net blocks, addresses), counting each block a line expands to
+    netblocks = 0
+    addresses = 0
+    for netblock in netblocklist:
+        netblocks += netblock.getCount()
+        addresses += netblock.getCount() * (1L << (32 - netblock.cidr))
+    return (netblocks, addresses)
+
+def countNodes(node):
+    count = 1
+    for child in node.children:
+        count += countNodes(child)
+    return count
 
 def printTree(node, gotolevel):
     if node.level <= gotolevel: 
@@ -307,8 +2542,9 @@ def printTree(node, gotolevel):
         print "%sL%d %s : %s" % (mylevel, node.level, node.name, node.longName)
         netblocklist = []
         node.getNetblocks(netblocklist, True)
-        for item in netblocklist:
-            print "%s%s/%d %s" % (mylevel + "   ", item.startAddress, item.cidr, item.pmapName)
+        for netblock in netblocklist:
+            for item in netblock.getNetblocks():
+                print "%s%s/%d %s" % (mylevel + "   ", intToIp(item.start), item.cidr, netblock.getPmapName())
         for child in node.children:
             printTree(child, gotolevel)
 
@@ -344,16 +2580,51 @@ def mkdir_p(path):
         else:
             raise
 
-def isIPv4Address(txt):
-    if not '.' in txt:
-        return False 
-    quads = txt.split('.')
+def ipToInt(txt):
+    # dotted-quad text to a 32-bit integer; raises ValueError if it isn't one
+    quads = txt.strip().split('.')
     if len(quads) != 4:
-        return False
+        raise ValueError("not a dotted-quad IPv4 address: %s" % txt)
+    number = 0
     for quad in quads:
-        if not 0 <= int(quad) <= 255:
-            return False
-    return True
+        value = int(quad)
+        if not 0 <= value <= 255:
+            raise ValueError("not a dotted-quad IPv4 address: %s" % txt)
+        number = (number << 8) | value
+    return number
+
+def intToIp(number):
+    return "%d.%d.%d.%d" % ((number >> 24) & 255, (number >> 16) & 255, (number >> 8) & 255, number & 255)
+
+def rangeToCidrs(first, last):
+    # minimal list of (start, cidr) blocks exactly covering first-last inclusive
+    blocks = []
+    while first <= last:
+        # largest block aligned at first that doesn't run past last
+        cidr = 32
+        while cidr > 0:
+            size = 1L << (32 - cidr + 1)
+            if first % size or first + size - 1 > last:
+                break
+            cidr -= 1
+        blocks.append((first, cidr))
+        first += 1L << (32 - cidr)
+    return blocks
+
+def getNumRangesCount(quads):
+    count = 1
+    for numranges in quads:
+        quadcount = 0
+        for low, high in numranges:
+            quadcount += high - low + 1
+        count *= quadcount
+    return count
+
+def getCidrMask(cidr):
+    return (0xFFFFFFFFL << (32 - cidr)) & 0xFFFFFFFFL
+
+def getLastAddress(first, cidr):
+    return first + (1L << (32 - cidr)) - 1
 
 def tryOpen(path,mode):
     # refactoring out a lot of repeated I/O exception wrapping
@@ -379,59 +2650,59 @@ def tryClose(fileref):
         logger.error("Exception closing file: %s" % (str(e)))
         sys.exit(1)
 
-def getCleanName(mystr):
+def getCleanName(mystr, location):
     # name needs to be cleaned up as needed to ensure it'll work as part of a file name
     name = mystr.strip().lower()
-    newname = ""
+    newchars = []
     goodchars = "abcdefghijklmnopqrstuvwxyz0123456789-_."
     # remove non-desired chars
     for char in name:
         if char in goodchars:
-            newname = newname + char
+            newchars.append(char)
         else:
-            newname = newname + '_'
-            logger.debug("Line %d: Replacing bad file name character '%s' with '_': %s" % (linecounter,char,name))
+            newchars.append('_')
+            logger.debug("%s: Replacing bad file name character '%s' with '_': %s" % (location,char,name))
 
-    newname = newname.strip()
+    newname = "".join(newchars).strip()
 
     if mystr != newname:
-        logger.info("Line %d: Replaced level name '%s' with '%s' for use as part of file name" % (linecounter,mystr,newname))
+        logger.info("%s: Replaced level name '%s' with '%s' for use as part of file name" % (location,mystr,newname))
 
     return newname
 
-def checkForInvalidPmapChars(mystr):
+def checkForInvalidPmapChars(mystr, location=None):
     mystr = mystr.strip()
     # pmap's won't allow certain chars so we have to check for those
     # according to rwpmapbuild man a comma is actually allowed but will break some usage
     badchars = ","
     for char in mystr:
         if char in badchars:
-            # try/except needed here because this method can be called from options area before logger is set up
-            try:
-                logger.error("Line %d: Found '%s' character which is not allowed as part of pmap description/text" % (linecounter,char))
-            except NameError:
-                msg = "Sorry, '%s' character is not allowed as part of -j/--pmap-joiner string" % (char)
+            # no location means this was called from the options area before logger is set up
+            if location is not None:
+                logger.error("%s: Found '%s' character which is not allowed as part of pmap description/text" % (location,char))
+            else:
+                msg = "Sorry, '%s' character is not allowed as part of -c/--pmap-concat string" % (char)
                 print "ERROR: %s" % msg 
             sys.exit(1)
     return mystr
 
-def getCleanLevel(mystr):
+def getCleanLevel(mystr, location):
     # this will be the node level
     mystr = mystr.strip()
     if mystr.startswith('L'):
         # grab everything after the L
         mystr = mystr[1:]
     else:
-        logger.error("Line %d: The setter level config does not start with L; e.g., Ln=shortname: %s" % (linecounter,mystr))
+        logger.error("%s: The setter level config does not start with L; e.g., Ln=shortname: %s" % (location,mystr))
         sys.exit(1)
     mynum = int(mystr)
     # check to see that it's a positive integer in a reasonable range
     if not 0 <= mynum <= 100:
-        logger.error("Line %d: The setter level doesn't appear to be an integer (0-100): %s" % (linecounter,mystr))
+        logger.error("%s: The setter level doesn't appear to be an integer (0-100): %s" % (location,mystr))
         sys.exit(1)
     return mynum
 
-def getConfigLineTokens(setterline):
+def getConfigLineTokens(setterline, location):
     #setter:L1=someshortname|Some Long Name
     # idea is that short name will be lower cased, and short, and used in set/pmap file names,
     # where long name will be proper cased, can be longer, and will become part of 
@@ -440,74 +2711,69 @@ def getConfigLineTokens(setterline):
     # split at the setter header colon
     tokens = setterline.split(':')
     if len(tokens) != 2:
-        logger.error("Line %d: Problem parsing setter configuration; should be one and only one colon: %s" % (linecounter,setterline))
+        logger.error("%s: Problem parsing setter configuration; should be one and only one colon: %s" % (location,setterline))
         sys.exit(1)
 
     # process the line part after #setter:
     sections = tokens[1].split('|')
     if len(sections) != 2:
-        logger.info("Line %d: Processed config entry with no long name: %s" % (linecounter,setterline))
+        logger.info("%s: Processed config entry with no long name: %s" % (location,setterline))
 
     # do level and name (both required)
     parts = sections[0].split('=')
     if len(parts) != 2:
-        logger.error("Line %d: Problem parsing first section of setter config entry; requires Ln=shortname: %s" % (linecounter,setterline))
+        logger.error("%s: Problem parsing first section of setter config entry; requires Ln=shortname: %s" % (location,setterline))
         sys.exit(1)
 
-    level = getCleanLevel(parts[0]) 
-    name = getCleanName(parts[1])
+    level = getCleanLevel(parts[0], location)
+    name = getCleanName(parts[1], location)
 
     # do the long name if there is one
     # it's not required and would be empty if they don't want the long name
     # for this node to show up in the concatenated pmap name
     if len(sections) > 1:
-        longname = checkForInvalidPmapChars(sections[1])
+        longname = checkForInvalidPmapChars(sections[1], location)
     else:
         longname = ""
 
     return (level,name,longname)
 
-def loadNumSet(addressElement,myset):
+def getNumRanges(addressElement):
     # silk allows addresses to include commas and ranges
-    # so we have to break those out into quad sets to iterate later
-    if ',' in addressElement or '-' in addressElement:
-        # 2.3.4.5,7,9-21
-        # if there aren't any commas, this will still return a list of one element
-        parts = addressElement.split(',')
-        for part in parts:
-            if '-' in part:
-                # add numbers for range
-                myrange = part.split('-')
-                mystart = int(myrange[0])
-                myend = int(myrange[1])
-                i = mystart
-                while i <= myend:
-                    myset.add(i)
-                    i = i + 1
-            else:
-                # add comma'd number
-                myset.add(part)
-    else:
-        # just a single number
-        myset.add(addressElement)
+    # so we break those out into a sorted list of (low, high) quad ranges,
+    # merging any that touch, rather than listing every number
+    # 2.3.4.5,7,9-21
+    # if there aren't any commas, this will still return a list of one element
+    bounds = []
+    for part in addressElement.split(','):
+        if '-' in part:
+            myrange = part.split('-')
+            bounds.append((int(myrange[0]), int(myrange[1])))
+        else:
+            bounds.append((int(part), int(part)))
+    bounds.sort()
+    numranges = []
+    for low, high in bounds:
+        if not 0 <= low <= 255 or not 0 <= high <= 255:
+            return None
+        if low > high:
+            continue
+        if numranges and low <= numranges[-1][1] + 1:
+            if high > numranges[-1][1]:
+                numranges[-1] = (numranges[-1][0], high)
+        else:
+            numranges.append((low, high))
+    return numranges
 
-def getConfigLineNetblocks(line):
+def getConfigLineNetblocks(line, location):
     # check the config line for netblock info, tweak as needed, and
     # return list of netblock objects
-    # if the line includes commas or ranges then we have to build
-    # a netblock for each different IP address, so we return a list
-    # of netblocks to meet all contingencies
+    # a line with commas, ranges or x's becomes a single NetblockRange holding
+    # its per-quad ranges, expanded only when output is written; a start-end
+    # range becomes the cidr netblocks covering it; anything else is one Netblock
     netblocklist = []
     cidr = ""
 
-    # temp containers
-    # storing in sets so we can capture all the variants presented as
-    # single numbers, comma-delimited sets, and range-delimited sets
-    anums = set()
-    bnums = set()
-    cnums = set()
-    dnums = set()
-
     myline = line.strip()
     if '#' in myline:
         # some address block entries may contain comments within the line
@@ -515,6 +2781,10 @@ def getConfigLineNetblocks(line):
         # e.g., 2.2.2.0/24      # some random comment
         myline = myline.split('#')[0].strip()
 
+    # whole-address ranges, e.g. 10.0.0.5-10.0.3.17
+    if isStartEndRange(myline):
+        return getStartEndNetblocks(myline, line, location)
+
     # if has cidr provided, grab that
     if '/' in myline:
         tokens = myline.split('/')
@@ -540,7 +2810,7 @@ def getConfigLineNetblocks(line):
     # try to determine cidr when not given
     if '0' in quads:
         if a in z:
-            logger.error("Line %d: 0 is not allowed in IPv4 address first quad; %s" % (linecounter,line))
+            logger.error("%s: 0 is not allowed in IPv4 address first quad; %s" % (location,line))
             sys.exit(1)
         # don't change the cidr if it was assigned within the file
         if cidr == "": 
@@ -561,7 +2831,7 @@ def getConfigLineNetblocks(line):
             # a set of all addresses ending in 255.  To convert to pmaps, we need a cidr,
             # so I am treating 0's like x's when it comes to guessing cidr maps.  For this 
             # reason, I'm also not allowing a quad x's.
-            logger.error("Line %d: x is not allowed in IPv4 address first quad; %s" % (linecounter,line))
+            logger.error("%s: x is not allowed in IPv4 address first quad; %s" % (location,line))
             sys.exit(1)
 
         """
@@ -599,146 +2869,318 @@ def getConfigLineNetblocks(line):
         cidr = 32
 
     if not 7 < cidr <= 32:
-        logger.error("Line %d: Address block with slash has inappropriate CIDR notation, expecting 8-32; %s" % (linecounter,line))
+        logger.error("%s: Address block with slash has inappropriate CIDR notation, expecting 8-32; %s" % (location,line))
         sys.exit(1)
 
-    loadNumSet(a,anums)
-    loadNumSet(b,bnums)
-    loadNumSet(c,cnums)
-    loadNumSet(d,dnums)
-
-    for a in anums:
-        for b in bnums:
-            for c in cnums:
-                for d in dnums:
-                    # create a netblock and load it up
-                    address2 = "%d.%d.%d.%d" % (int(a),int(b),int(c),int(d)) 
-                    #print "a.b.c.d/cidr is: %s/%d" % (address2,cidr)
-                    if not isIPv4Address(address2):
-                        logger.error("Line %d: Derived address block is not a dotted-quad IPv4 address; %s" % (linecounter,line))
-                        sys.exit(1)
-                    netblock = Netblock(address2, cidr)
-                    netblocklist.append(netblock)
-
-    return netblocklist
-
-def readSetTextFile():
-    setFile  = tryOpen(SET_TXT_FILE, 'r')
-
-    global currentnode
-    global linecounter
-    global levelentryingested
-    global levelzeroingested
-    global root
-
-    for line in setFile:
-        linecounter += 1
-        
-        # ignore blank lines
-        if len(line.strip()) == 0:
-            continue
-
-        # chop off any newlines and beginning/ending white space
-        line = line.strip()
-
-        if line.startswith('#') and not line.startswith('#setter:'):
-            logger.debug("Line %d: Skipping comment: %s" % (linecounter,line))
-            continue
+    # keep the comma/range variants as per-quad ranges; the individual
+    # netblocks are only produced when output gets written
+    quads = []
+    for quad in (a, b, c, d):
+        numranges = getNumRanges(quad)
+        if not numranges:
+            logger.error("%s: Derived address block is not a dotted-quad IPv4 address; %s" % (location,line))
+            sys.exit(1)
+        quads.append(numranges)
 
-        if line.startswith('#setter:'):
-            # load the config info
+    if getNumRangesCount(quads) == 1:
+        start = (quads[0][0][0] << 24) | (quads[1][0][0] << 16) | (quads[2][0][0] << 8) | quads[3][0][0]
+        netblocklist.append(Netblock(start, cidr))
+    else:
+        netblocklist.append(NetblockRange(quads, cidr))
 
-            logger.debug("Line %d: Found setter config line: %s" % (linecounter,line))
+    return netblocklist
 
-            level,name,longname = getConfigLineTokens(line)
+def isStartEndRange(myline):
+    # a start-end range has a full dotted quad on each side of a single dash,
+    # unlike per-quad ranges such as 10.3.1-4.0
+    parts = myline.split('-')
+    return len(parts) == 2 and parts[0].count('.') == 3 and parts[1].count('.') == 3
 
-            # change the info on the root node
-            # make sure we only have one level zero entry and it is the first entry
-            # so we can rename root before populating other nodes
-            if level == 0:
-                if levelzeroingested:
-                    logger.error("Line %d: You may only include one level 0 entry and it must be the first setter config entry: %s" % (linecounter,line))
-                    sys.exit(1)
-                else:
-                    levelzeroingested = True
+def getStartEndNetblocks(myline, line, location):
+    # return the fewest cidr netblocks covering a start-end address range
+    if '/' in myline:
+        logger.error("%s: A start-end address range may not include a CIDR slash; %s" % (location,line))
+        sys.exit(1)
+    tokens = myline.split('-')
+    try:
+        first = ipToInt(tokens[0])
+        last = ipToInt(tokens[1])
+    except ValueError:
+        logger.error("%s: Start-end address range needs a dotted-quad IPv4 address on each side of the dash; %s" % (location,line))
+        sys.exit(1)
+    if first > last:
+        logger.error("%s: Start-end address range starts after it ends; %s" % (location,line))
+        sys.exit(1)
+    netblocklist = []
+    for start, cidr in rangeToCidrs(first, last):
+        if cidr < 8:
+            logger.error("%s: Start-end address range spans more than a /8, expecting CIDR blocks of 8-32; %s" % (location,line))
+            sys.exit(1)
+        netblocklist.append(Netblock(start, cidr))
+    return netblocklist
 
-                if levelentryingested:
-                    logger.error("Line %d: If you include a level 0 entry it must be the first setter config entry: %s" % (linecounter,line))
-                    sys.exit(1)
-                else:
-                    levelentryingested = True
-        
-                root.setName(name)
-                root.setLongName(longname)
-                continue
+def loadContent(paths, options, sources=None):
+    # parse the content files, through the tree cache unless -N was given
+    if options.nocache:
+        return loadTree(paths, options.pmapconcat, options.jobs, sources)
+    return loadCachedTree(paths, options.pmapconcat, options.jobs, sources)
+
+def loadTree(paths, pmapconcat=' - ', jobs=1, sources=None):
+    # parse one or more setter content files, following any include
+    # directives, and return the root node of the combined tree
+    # the first file is the main one; any others add their subtrees under the root
+    # included files are parsed jobs at a time in separate processes
+    # sources, if given, gets the path of every file that was read
+    if isinstance(paths, basestring):
+        paths = [paths]
+    if sources is None:
+        sources = []
 
-            # cover non-zero ingests and the case where no level zero included in configs
-            if levelentryingested == False:
-                levelentryingested = True
+    root = Node("root","")
+    parser = Parser(paths[0], root, pmapconcat)
+    parser.parse()
+    sources.append(paths[0])
+
+    pending = parser.includes
+    for path in paths[1:]:
+        pending.append(Include(Node("", "", root), path, (), "Command line"))
+
+    # includes can include more files, so keep going until none are left
+    while pending:
+        tasks = []
+        for include in pending:
+            tasks.append((include.path, include.slot.parent.level, pmapconcat, include.chain))
+        if jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(tasks)))
+            try:
+                results = pool.map(parseFragment, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(parseFragment, tasks)
 
-            # asking to go down more than one node
-            if (level - currentnode.level) > 1:
-                logger.error("Line %d: Inconsistent level assignment; e.g., L3 being assigned before L2: %s" % (linecounter,line))
+        nextpending = []
+        for include, result in zip(pending, results):
+            if result is None:
+                # the fragment's parser already logged why
                 sys.exit(1)
-                 
-            # asking to add child
-            if level == currentnode.level + 1: 
-                # create a node and add it as child
-                child = Node(name,longname,currentnode)
-                currentnode = child
-
-            # asking to add sibling
-            elif level == currentnode.level: 
-                currentnode = currentnode.parent
-                # create a node and add it as child
-                child = Node(name,longname,currentnode)
-                currentnode = child
-
-            # asking to add node higher in the tree 
-            elif level < currentnode.level:
-                while (level - 1) < currentnode.level:
-                    currentnode = currentnode.parent
-                # create a node and add it as child
-                child = Node(name,longname,currentnode)
-                currentnode = child
+            fragmentroot, includes = result
+            mergeFragment(include, fragmentroot)
+            sources.append(include.path)
+            nextpending.extend(includes)
+        pending = nextpending
+
+    # names cached while parsing fragments only saw part of the tree
+    primeNames(root, pmapconcat)
+    return root
+
+def parseFragment(task):
+    # parse an included file into a subtree whose top is a stand-in for the node
+    # it was included under; runs in a worker process, so errors come back as None
+    path, level, pmapconcat, chain = task
+    fragmentroot = Node("", "")
+    fragmentroot.level = level
+    parser = Parser(path, fragmentroot, pmapconcat, False, chain)
+    try:
+        parser.parse()
+    except SystemExit:
+        return None
+    return (fragmentroot, parser.includes)
+
+def mergeFragment(include, fragmentroot):
+    # swap the include's placeholder node for the fragment's top-level nodes,
+    # and give any blocks above those nodes to the including node
+    parent = include.slot.parent
+    index = parent.children.index(include.slot)
+    for child in fragmentroot.children:
+        child.parent = parent
+    parent.children[index:index + 1] = fragmentroot.children
+    for netblock in fragmentroot.netblocks:
+        parent.addNetblock(netblock)
+
+def primeNames(node, pmapconcat=' - '):
+    # reset and recompute the cached file and pmap names with the chosen joiner
+    node.filename = ""
+    node.pmapname = ""
+    node.getPmapName(pmapconcat)
+    node.getFileName()
+    for child in node.children:
+        primeNames(child, pmapconcat)
+
+def getCachePath(path):
+    return "%s.setter-cache" % (path)
+
+def getFileKey(path):
+    # a file's size, mtime and hash, which a cached tree depends on
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    contentFile = tryOpen(path, 'r')
+    while True:
+        data = contentFile.read(1048576)
+        if not data:
+            break
+        digest.update(data)
+    tryClose(contentFile)
+    return (path, stat.st_size, stat.st_mtime, digest.hexdigest())
+
+def isCacheCurrent(header, paths, pmapconcat):
+    # header is (format, pmap joiner, paths given, key of every file read); the
+    # joiner matters because it is baked into the nodes' cached pmap names
+    # check the format first; older formats had differently shaped headers
+    if header[0] != CACHE_FORMAT:
+        return False
+    cacheformat, cachedconcat, cachedpaths, filekeys = header
+    if cachedconcat != pmapconcat or cachedpaths != tuple(paths):
+        return False
+    for filekey in filekeys:
+        if not os.path.isfile(filekey[0]) or getFileKey(filekey[0]) != filekey:
+            return False
+    return True
 
+def loadCachedTree(paths, pmapconcat=' - ', jobs=1, sources=None):
+    # like loadTree, but reuses the tree saved next to the main content file when
+    # every file it was made from is unchanged, and saves a fresh one when not
+    # the cache is plain marshalled values, never pickles, and is only read if
+    # it is yours and nobody else can write it
+    if isinstance(paths, basestring):
+        paths = [paths]
+    if sources is None:
+        sources = []
+    cachepath = getCachePath(paths[0])
+    if os.path.isfile(cachepath):
+        try:
+            cacheFile = open(cachepath, 'rb')
+            try:
+                if not isCacheTrusted(cacheFile):
+                    logger.warning("Ignoring tree cache %s: it isn't owned by you or others can write to it" % (cachepath))
+                else:
+                    # the header is stored on its own ahead of the tree so a stale
+                    # cache is spotted without loading the whole tree
+                    header = marshal.load(cacheFile)
+                    if isCacheCurrent(header, paths, pmapconcat):
+                        sourcelist, packed = marshal.load(cacheFile)
+                        root = unpackTree(packed, sourcelist)
+                        logger.debug("Loaded tree from cache %s" % (cachepath))
+                        for filekey in header[3]:
+                            sources.append(filekey[0])
+                        return root
+                    logger.debug("Tree cache %s is stale" % (cachepath))
+            finally:
+                cacheFile.close()
+        except Exception, e:
+            logger.warning("Ignoring unreadable tree cache %s: %s" % (cachepath, str(e)))
+
+    root = loadTree(paths, pmapconcat, jobs, sources)
+    filekeys = []
+    for path in sources:
+        filekeys.append(getFileKey(path))
+    header = (CACHE_FORMAT, pmapconcat, tuple(paths), filekeys)
+    sourcemap = {}
+    packed = packTree(root, sourcemap)
+    sourcelist = [None] * len(sourcemap)
+    for source, position in sourcemap.items():
+        sourcelist[position] = source
+
+    # write then rename so readers never see a partial cache; made only
+    # writable by us, since a cache others could write is never read
+    temppath = "%s.%d.tmp" % (cachepath, os.getpid())
+    try:
+        cacheFile = os.fdopen(os.open(temppath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0644), 'wb')
+        try:
+            marshal.dump(header, cacheFile)
+            marshal.dump((sourcelist, packed), cacheFile)
+        finally:
+            cacheFile.close()
+        os.rename(temppath, cachepath)
+        logger.debug("Saved tree cache %s" % (cachepath))
+    except (IOError, OSError, ValueError), e:
+        logger.warning("Could not save tree cache %s: %s" % (cachepath, str(e)))
+        if os.path.exists(temppath):
+            os.remove(temppath)
+    return root
+
+def isCacheTrusted(cacheFile):
+    # checked on the open file, so it can't be swapped after the check
+    info = os.fstat(cacheFile.fileno())
+    if info.st_uid != os.getuid():
+        return False
+    return not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def packTree(node, sourcemap):
+    # the tree as nested tuples of plain values for marshal; sourcemap gets
+    # each content file path and the number blocks refer to it by
+    blocks = []
+    for netblock in node.netblocks:
+        source = sourcemap.setdefault(netblock.source, len(sourcemap))
+        if isinstance(netblock, NetblockRange):
+            blocks.append((netblock.quads, netblock.cidr, netblock.line, source, netblock.cover))
         else:
-            # build netblock instance from address info
-            # some lines will need to be converted into multiple netblocks
-            # e.g., 2.3-4.2.2 would produce 2 netblocks
-
-            logger.debug("Line %d: Found address line of %s" % (linecounter, line))
-
-            blocks = getConfigLineNetblocks(line)
-            for block in blocks:
-                logger.debug("Line %d: Adding netblock %s/%d to node %s" % (linecounter,
-                    block.getStartAddress(), block.getCidr(), currentnode.getPmapName(options.pmapconcat)))
-                currentnode.addNetblock(block)
-
-    tryClose(setFile)
+            blocks.append((netblock.start, netblock.cidr, netblock.line, source))
+    children = []
+    for child in node.children:
+        children.append(packTree(child, sourcemap))
+    return (node.name, node.longName, node.filename, node.pmapname, blocks, children)
+
+def unpackTree(packed, sourcelist, parent=None):
+    # rebuilds a tree stored by packTree
+    name, longName, filename, pmapname, blocks, children = packed
+    node = Node(name, longName, parent)
+    node.filename = filename
+    node.pmapname = pmapname
+    for block in blocks:
+        if len(block) == 5:
+            quads, cidr, line, source, cover = block
+            netblock = NetblockRange(quads, cidr, node, line, sourcelist[source])
+            netblock.cover = cover
+        else:
+            start, cidr, line, source = block
+            netblock = Netblock(start, cidr, node, line, sourcelist[source])
+        node.netblocks.append(netblock)
+    for child in children:
+        unpackTree(child, sourcelist, node)
+    return node
 
 def processOptions():
     """ process commandline options """
     usage = """usage: ./%prog [options]
+       ./%prog [options] lookup [address[,address...] | address-file | -] ...
+       ./%prog [options] classify [address-file | -] ...
+       ./%prog [options] export-sqlite database-file
+       ./%prog [options] diff old-setter-text-file [new-setter-text-file]
+       ./%prog [options] serve [socket-path]
     use -h for help / option descriptions 
     """
 
     parser = optparse.OptionParser(usage)
     parser.add_option("-c", "--pmap-concat", dest="pmapconcat", help="""Allows default pmap name concatenation string of ' - ' to be overridden.  A node's pmap name is derived from a reversed concatenation of the node's non-empty long name and each ancestor node's non-empty long name, separated by this concatenation string.  E.g., Grandparent - Parent - Child""")
+    parser.add_option("-C", "--check-overlaps", action="store_true", dest="checkoverlaps", help="""Optional.  Report every pair of net blocks in different nodes that cover the same addresses, with line numbers, node paths, and the label the pmap will use for them.  When used, setter will terminate before creating the real files, with exit status 1 if any overlaps were found.""")
+    parser.add_option("-D", "--reuse-cache", dest="reusecache", help="""Folder of outputs kept by the hash of their input, shared between runs.  Files whose input matches one there are linked to it instead of being built, and newly built files are added to it.  Within a run, files with the same input as another (e.g., a node whose only content is one child) are always linked to the first rather than built again.  With -F, every file is built and none are linked.""")
     parser.add_option("-d", "--debug", action="store_true", dest="debug", help="""Optional.  Dump debug (vice info) output to the command line interface.  Debug-level output is automatically logged to rotating log files and is far easier to review there.""")
     parser.add_option("-f", "--print-file-names", action="store_true", dest="printfilenames", help="""Optional.  Print the names of files that would be created (truncates if set-level option provided).  This is meant for use to check your setter-context file configuration.  When used, setter will terminate before creating the real files.""")
-    parser.add_option("-i", "--in-file", dest="settxtfile", help="""Setter text file to process. Default is ~/setter-content.txt.""")
+    parser.add_option("-F", "--force", action="store_true", dest="force", help="""Rebuild every file even when the manifest in the output folder shows its input is unchanged.""")
+    parser.add_option("-I", "--range-index", action="store_true", dest="rangeindex", help="""Also write ROOT.range-index, a compact binary file of the tree's non-overlapping address ranges and their long name, short name, and node path, for programs that can't read SiLK files.  It is laid out to be read through mmap without parsing; setter.RangeIndex reads it.""")
+    parser.add_option("-i", "--in-file", action="append", dest="settxtfile", help="""Setter text file to process. Default is ~/setter-content.txt.  May be repeated; the first file is the main one and each other file adds its nodes under the root, as if included at the end of the main file.  Files may also pull in others with a #setter-include:path line, which adds the included file's nodes under the current node.  Included files are parsed --jobs at a time.""")
+    parser.add_option("--jobs", dest="jobs", help="""Number of rwsetbuild/rwpmapbuild processes to run (and included files to parse) at the same time.  Default is 1.  If any build fails, remaining builds are cancelled and the first failing file is reported.""")
     parser.add_option("-l", "--log-path", dest="logpath", help="""Path where you want setter.log file written. Default is your home dir.""")
+    parser.add_option("-m", "--metrics", dest="metrics", help="""Optional.  Write a JSON report to this file with wall and cpu time for each phase of the run, and for each output file its net block count, bytes piped to the SiLK tool, tool run time, and exit status, plus node count, total addresses, and peak memory.""")
+    parser.add_option("-M", "--flatten-pmaps", action="store_true", dest="flattenpmaps", help="""Work out which label wins for every address before calling rwpmapbuild, and give it only non-overlapping net blocks with neighbouring blocks of the same label merged, rather than every net block with more specific ones overriding the blocks they sit in.  Lookups give the same labels, but pmaps with nested net blocks get far fewer records and build faster.  A pmap whose flattened form would have more records (e.g., many single addresses scattered through a large block) is left as it was.""")
+    parser.add_option("-N", "--no-cache", action="store_true", dest="nocache", help="""Always parse the setter text file rather than reusing (or writing) the parsed tree cached next to it in a .setter-cache file.  The cache is only reused when the text file's size, modification time, and content hash all match, and only read when it is owned by you and not writable by group or others.""")
     parser.add_option("-o", "--out-path", dest="outpath", help="""Path where you want files written. Default is your home dir inside a date-setter folder.""")
+    parser.add_option("--only", action="append", dest="only", help="""Only create the files of this node, its descendants, and its ancestors, leaving other nodes' files alone.  The node is given by its file name as -f prints it (without the extension), with or without the root's name in front; e.g., --only customers-apple.  May be repeated.  Most useful with -O, so the other files are already in the output folder.""")
     parser.add_option("-O", "--no-out-date", action="store_true", dest="nooutdate", help="""Do not include the processed date in the folder name where output files are written.""")
     parser.add_option("-p", "--pmap-long-level", dest="pmaplonglevel", help="""Level restriction used when creating long-description pmap files.  Default is all levels.  E.g., -p 1 would create a long pmap file for level 0 and each level 1 entry.  Every level file includes records for itself and all descendant levels.""")
     parser.add_option("-P", "--no-long-pmap", action="store_true", dest="nolongpmap", help="""Do not create long (proper name) pmap files.""")
     parser.add_option("-r", "--pmap-short-level", dest="pmapshortlevel", help="""Level restriction used when creating short-description pmap files.  Default is all levels.  E.g., -r 1 would create a short pmap file for level 0 and each level 1 entry.  Every level file includes records for itself and all descendant levels.""")
     parser.add_option("-R", "--no-short-pmap", action="store_true", dest="noshortpmap", help="""Do not create short (file-name-based) pmap files.""")
     parser.add_option("-s", "--set-level", dest="setlevel", help="""Level restriction used when creating set files.  Default is all levels.  E.g., -s 3 would create a set file for level 0 and each level 1, 2, and 3 entry.  Every level file includes records for itself and all descendant levels.""")
+    parser.add_option("--stream", action="store_true", dest="stream", help="""Build each node's files as soon as its last line has been read, while the rest of the setter text file is still being parsed, rather than parsing the whole file first.  With -u, -P and -R, each node's net blocks are also dropped once its set file is built, so memory stays low for very large files.  Works with a single setter text file without include lines, and not with -C, -f, -I, --only, -t, -w, -x or the commands.""")
     parser.add_option("-S", "--no-set", action="store_true", dest="noset", help="""Do not create set files.""")
     parser.add_option("-t", "--print-tree", action="store_true", dest="printtree", help="""Optional.  Print a text representation of the tree of nodes that will be loaded from setter-context.txt (truncates if set-level option provided).  This is meant for use to check your setter-context file configuration.  When used, setter will terminate before creating the real files.""")
+    parser.add_option("-u", "--union-sets", action="store_true", dest="unionsets", help="""Build each parent set file by unioning its children's set files (rwsettool --union) with a set of its own net blocks, rather than feeding every descendant address to rwsetbuild again.  Leaf sets are built first and parents follow in dependency order.""")
     parser.add_option("-v", "--version", action="store_true", dest="version", help="""Indicates script version""")
+    parser.add_option("-w", "--watch", dest="watch", help="""Keep running, checking the setter text files (and any they include) for changes every this many seconds and rebuilding only the files whose content changed.  Each build is written to its own dated folder under the out path and published by atomically repointing an out-path/setter-out symlink at it, so readers never see a partly written folder.  The previous build is kept until the next one is published.  -O does not apply.  With the serve command, sets how often the files are checked for a reload instead; default 5 seconds.""")
+    parser.add_option("-x", "--derive", action="append", dest="derive", help="""Also create a set file computed from the tree, written as NAME=EXPRESSION and creating NAME.set.  May be repeated.  The expression is node paths or cidr blocks, joined by operators with spaces around them and applied left to right: & (in both), | (in either), - (in the left but not the right).  A node path is the short names from the top level down to the node, joined by / (e.g. my_mssp/customers, or just customers with no L0 name), the same path the lookup command prints.  E.g., -x "unassigned=10.0.0.0/8 - my_mssp/customers" or -x "shared=my_mssp/sensors & my_mssp/customers".  Created even with -S.""")
     
     (options, args) = parser.parse_args()
 
@@ -785,6 +3227,28 @@ def processOptions():
     else:
         options.pmapshortlevel = MAX_DEPTH 
 
+    if options.jobs:
+        try:
+            options.jobs = int(options.jobs)
+        except ValueError, e:
+            print("Exception: jobs option requires an integer value: you provided '%s'" % (options.jobs))
+            sys.exit(1)
+        if options.jobs < 1:
+            print("The jobs option value, when used, must be 1 or more: you provided '%s'" % (options.jobs))
+            sys.exit(1)
+    else:
+        options.jobs = 1
+
+    if options.watch:
+        try:
+            options.watch = int(options.watch)
+        except ValueError, e:
+            print("Exception: watch option requires an integer value: you provided '%s'" % (options.watch))
+            sys.exit(1)
+        if options.watch < 1:
+            print("The watch option value, when used, must be 1 or more: you provided '%s'" % (options.watch))
+            sys.exit(1)
+
     if not options.pmapconcat:
         options.pmapconcat = ' - '
     else: